@@ -0,0 +1,324 @@
+"""
+Load Test Harness
+
+Seeds the database with carts and items made by the test factories, then
+drives every REST endpoint at a fixed concurrency through the Flask test
+client. Throughput, latency percentiles and SQL queries per request are
+reported per endpoint. Requests are not coalesced, so the query counts do
+not depend on timing. The results can be saved as a JSON baseline, or
+compared against one so that a regression fails the run.
+
+Usage:
+  export DATABASE_URI=sqlite:///bench.db
+  python -m benchmarks.load_test --save benchmarks/baselines/load_test.json
+  python -m benchmarks.load_test --compare benchmarks/baselines/load_test.json
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+from service import app
+from service.models import db, Shopcart, Item
+from tests.factories import ShopcartFactory, ItemFactory
+
+BASE_URL = "/api/shopcarts"
+
+# A route to drive: prepare(seed) returns the path and the keyword arguments
+# of the test client call, and runs before the request is timed
+Endpoint = namedtuple("Endpoint", "name method prepare")
+
+
+class QueryCounter:
+    """Counts the SQL statements that each thread sends to the database"""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):  # pylint: disable=unused-argument
+        self._local.count = self.count + 1
+
+    @property
+    def count(self):
+        """The statements counted in this thread since the last reset"""
+        return getattr(self._local, "count", 0)
+
+    def reset(self):
+        """Starts counting again from zero in this thread"""
+        self._local.count = 0
+
+
+######################################################################
+# S E E D   D A T A
+######################################################################
+def make_shopcart(item_count):
+    """Creates a Shopcart with item_count Items and returns its id"""
+    shopcart = ShopcartFactory()
+    shopcart.create()
+    db.session.add_all(
+        ItemFactory(id=None, shopcart=shopcart) for _ in range(item_count)
+    )
+    shopcart.total_price = shopcart.get_total_price()
+    shopcart.update()
+    return shopcart.id
+
+
+def seed(cart_count, item_count):
+    """Replaces the data with cart_count carts of item_count items each"""
+    db.session.query(Item).delete()
+    db.session.query(Shopcart).delete()
+    db.session.commit()
+    cart_ids = [make_shopcart(item_count) for _ in range(cart_count)]
+    item_ids = {
+        cart_id: [item.id for item in Item.find_by_shopcart(cart_id)]
+        for cart_id in cart_ids
+    }
+    db.session.remove()
+    return item_ids
+
+
+######################################################################
+# E N D P O I N T S
+######################################################################
+def item_body(cart_id):
+    """A JSON body for an Item of the given cart"""
+    body = ItemFactory(id=None, shopcart_id=cart_id, shopcart=None).serialize()
+    del body["id"]
+    return body
+
+
+def any_item(seeded):
+    """Picks the path of one of the seeded Items"""
+    cart_id = random.choice(list(seeded))
+    return f"{BASE_URL}/{cart_id}/items/{random.choice(seeded[cart_id])}", cart_id
+
+
+def endpoints():
+    """The requests to drive, one for every route in service/routes.py"""
+    return [
+        Endpoint("GET /", "GET", lambda seeded: ("/", {})),
+        Endpoint("GET /health", "GET", lambda seeded: ("/health", {})),
+        Endpoint("GET /api/shopcarts", "GET", lambda seeded: (BASE_URL, {})),
+        Endpoint(
+            "POST /api/shopcarts",
+            "POST",
+            lambda seeded: (BASE_URL, {"json": {"customer_id": 1, "items": []}}),
+        ),
+        Endpoint(
+            "GET /api/shopcarts/{id}",
+            "GET",
+            lambda seeded: (f"{BASE_URL}/{random.choice(list(seeded))}", {}),
+        ),
+        Endpoint(
+            "PUT /api/shopcarts/{id}",
+            "PUT",
+            lambda seeded: (
+                f"{BASE_URL}/{random.choice(list(seeded))}",
+                {"json": {"customer_id": 2, "items": []}},
+            ),
+        ),
+        Endpoint(
+            "DELETE /api/shopcarts/{id}",
+            "DELETE",
+            lambda seeded: (f"{BASE_URL}/{make_shopcart(1)}", {}),
+        ),
+        Endpoint(
+            "GET /api/shopcarts/{id}/items",
+            "GET",
+            lambda seeded: (f"{BASE_URL}/{random.choice(list(seeded))}/items", {}),
+        ),
+        Endpoint("POST /api/shopcarts/{id}/items", "POST", post_item),
+        Endpoint(
+            "DELETE /api/shopcarts/{id}/items",
+            "DELETE",
+            lambda seeded: (f"{BASE_URL}/{make_shopcart(3)}/items", {}),
+        ),
+        Endpoint(
+            "GET /api/shopcarts/{id}/items/{item_id}",
+            "GET",
+            lambda seeded: (any_item(seeded)[0], {}),
+        ),
+        Endpoint("PUT /api/shopcarts/{id}/items/{item_id}", "PUT", put_item),
+        Endpoint("DELETE /api/shopcarts/{id}/items/{item_id}", "DELETE", delete_item),
+    ]
+
+
+def post_item(seeded):  # pylint: disable=unused-argument
+    """Prepares the creation of an Item in a new, empty cart"""
+    cart_id = make_shopcart(0)
+    return f"{BASE_URL}/{cart_id}/items", {"json": item_body(cart_id)}
+
+
+def put_item(seeded):
+    """Prepares an update of one of the seeded Items"""
+    path, cart_id = any_item(seeded)
+    return path, {"json": item_body(cart_id)}
+
+
+def delete_item(seeded):  # pylint: disable=unused-argument
+    """Prepares the deletion of the Item of a new cart"""
+    cart_id = make_shopcart(1)
+    item_id = Item.find_by_shopcart(cart_id)[0].id
+    path = f"{BASE_URL}/{cart_id}/items/{item_id}"
+    return path, {"content_type": "application/json"}
+
+
+######################################################################
+# M E A S U R E M E N T
+######################################################################
+def percentile(ordered, fraction):
+    """Returns the value at a fraction of a sorted list"""
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def call(client, counter, endpoint, seeded):
+    """Sends one request and returns (seconds, queries, succeeded)"""
+    with app.app_context():
+        path, kwargs = endpoint.prepare(seeded)
+        db.session.remove()
+        counter.reset()
+        start = time.perf_counter()
+        response = client.open(path, method=endpoint.method, **kwargs)
+        elapsed = time.perf_counter() - start
+        queries = counter.count
+        db.session.remove()
+    return elapsed, queries, response.status_code < 400
+
+
+def measure(endpoint, seeded, counter, args):
+    """Drives one endpoint and returns its statistics"""
+    client = app.test_client()
+    for _ in range(args.warmup):
+        call(client, counter, endpoint, seeded)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(
+            pool.map(
+                lambda _: call(client, counter, endpoint, seeded), range(args.requests)
+            )
+        )
+    wall = time.perf_counter() - start
+    latencies = sorted(elapsed for elapsed, _, _ in results)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, _, succeeded in results if not succeeded),
+        # prepare() runs inside the wall clock time, so this is a lower bound
+        "throughput": round(len(results) / wall, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "queries_per_request": round(
+            sum(queries for _, queries, _ in results) / len(results), 2
+        ),
+    }
+
+
+def compare(results, baseline, tolerance, slack_ms):
+    """Returns the regressions of results against a baseline"""
+    regressions = []
+    for name, before in baseline["endpoints"].items():
+        after = results["endpoints"].get(name)
+        if after is None:
+            continue
+        if after["queries_per_request"] > before["queries_per_request"]:
+            regressions.append(
+                f"{name}: {after['queries_per_request']} queries per request, "
+                f"was {before['queries_per_request']}"
+            )
+        if after["p95_ms"] > before["p95_ms"] * (1 + tolerance) + slack_ms:
+            regressions.append(
+                f"{name}: p95 {after['p95_ms']} ms, was {before['p95_ms']} ms"
+            )
+        if after["errors"] > before["errors"]:
+            regressions.append(f"{name}: {after['errors']} failed requests")
+    return regressions
+
+
+def parse_args():
+    """Parses the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--carts", type=int, default=100, help="carts to seed")
+    parser.add_argument("--items", type=int, default=10, help="items per cart")
+    parser.add_argument("--requests", type=int, default=200, help="per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--only", help="only endpoints whose name contains this")
+    parser.add_argument("--save", metavar="FILE", help="write the results here")
+    parser.add_argument("--compare", metavar="FILE", help="baseline to check")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="allowed relative p95 latency increase over the baseline",
+    )
+    parser.add_argument(
+        "--slack-ms",
+        type=float,
+        default=10.0,
+        help="allowed absolute p95 latency increase, on top of the tolerance",
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=10, help="untimed requests per endpoint"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Runs the load test"""
+    args = parse_args()
+    app.logger.setLevel(logging.CRITICAL)
+    # coalesced requests share the queries of another, by timing, so the
+    # query counts would not compare from one run to the next
+    app.config["SINGLE_FLIGHT"] = False
+    random.seed(0)
+    counter = QueryCounter(db.engine)
+    seeded = seed(args.carts, args.items)
+
+    results = {
+        "config": {
+            "database": db.engine.dialect.name,
+            "carts": args.carts,
+            "items": args.items,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "single_flight": app.config["SINGLE_FLIGHT"],
+        },
+        "endpoints": {},
+    }
+    print(
+        f"{'endpoint':<45} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'queries':>8} {'errors':>6}"
+    )
+    for endpoint in endpoints():
+        if args.only and args.only not in endpoint.name:
+            continue
+        stats = measure(endpoint, seeded, counter, args)
+        results["endpoints"][endpoint.name] = stats
+        print(
+            f"{endpoint.name:<45} {stats['throughput']:>8} {stats['p50_ms']:>8} "
+            f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} "
+            f"{stats['queries_per_request']:>8} {stats['errors']:>6}"
+        )
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as baseline:
+            json.dump(results, baseline, indent=2)
+            baseline.write("\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            regressions = compare(
+                results, json.load(baseline), args.tolerance, args.slack_ms
+            )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
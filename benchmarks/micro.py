@@ -0,0 +1,203 @@
+"""
+Model Micro-Benchmarks
+
+Times the per-request CPU hot paths of the models, Shopcart and Item
+serialize() and deserialize() and Shopcart.get_total_price(), over carts
+of 1, 100 and 10,000 items. Each case runs on objects built in memory and
+on objects freshly loaded from the database. Results are reported the way
+pytest-benchmark does and can be saved as, or compared against, a JSON
+baseline.
+
+Usage:
+  export DATABASE_URI=sqlite:///bench.db
+  python -m benchmarks.micro --save benchmarks/baselines/micro.json
+  python -m benchmarks.micro --compare benchmarks/baselines/micro.json
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+from functools import partial
+from service import app
+from service.models import db, Shopcart, Item
+from tests.factories import ShopcartFactory, ItemFactory
+
+
+######################################################################
+# C A R T S   U N D E R   T E S T
+######################################################################
+def memory_cart(item_count):
+    """Returns a function that builds a cart with item_count Items in memory"""
+    shopcart = ShopcartFactory(id=1)
+    shopcart.items = [ItemFactory(shopcart_id=1) for _ in range(item_count)]
+    shopcart.total_price = shopcart.get_total_price()
+    return lambda: shopcart
+
+
+def database_cart(item_count):
+    """Returns a function that loads a cart with item_count Items from the DB"""
+    shopcart = ShopcartFactory()
+    shopcart.create()
+    db.session.add_all(
+        ItemFactory(id=None, shopcart=shopcart) for _ in range(item_count)
+    )
+    shopcart.total_price = shopcart.get_total_price()
+    shopcart.update()
+    shopcart_id = shopcart.id
+
+    def load():
+        db.session.remove()
+        loaded = Shopcart.find(shopcart_id)
+        len(loaded.items)  # pylint: disable=pointless-statement
+        return loaded
+
+    return load
+
+
+######################################################################
+# O P E R A T I O N S
+######################################################################
+def deserialize_shopcart(data):
+    """Builds a new Shopcart from a serialized one"""
+    return Shopcart().deserialize(data)
+
+
+def deserialize_items(data):
+    """Builds new Items from serialized ones"""
+    return [Item().deserialize(item) for item in data["items"]]
+
+
+def serialize_items(shopcart):
+    """Serializes the Items of a Shopcart one by one"""
+    return [item.serialize() for item in shopcart.items]
+
+
+def serialize_cart(load):
+    """Loads a cart and serializes it, as input for the deserializers"""
+    return load().serialize()
+
+
+# name -> (operation, whether it takes the serialized cart instead)
+OPERATIONS = {
+    "Shopcart.serialize": (Shopcart.serialize, False),
+    "Shopcart.deserialize": (deserialize_shopcart, True),
+    "Item.serialize": (serialize_items, False),
+    "Item.deserialize": (deserialize_items, True),
+    "Shopcart.get_total_price": (Shopcart.get_total_price, False),
+}
+
+
+######################################################################
+# M E A S U R E M E N T
+######################################################################
+def run(operation, setup, rounds):
+    """Times rounds calls of operation on a fresh argument from setup()"""
+    timings = []
+    for _ in range(rounds):
+        argument = setup()
+        start = time.perf_counter()
+        operation(argument)
+        timings.append(time.perf_counter() - start)
+    return {
+        "min_ms": round(min(timings) * 1000, 4),
+        "mean_ms": round(statistics.mean(timings) * 1000, 4),
+        "median_ms": round(statistics.median(timings) * 1000, 4),
+        "stddev_ms": round(statistics.pstdev(timings) * 1000, 4),
+        "rounds": rounds,
+    }
+
+
+def cases(sizes):
+    """Yields (name, setup function, item count) for every cart to time"""
+    for item_count in sizes:
+        yield f"memory[{item_count}]", memory_cart(item_count), item_count
+        yield f"db[{item_count}]", database_cart(item_count), item_count
+
+
+def compare(results, baseline, tolerance, slack_ms):
+    """
+    Returns the benchmarks that regressed against a baseline
+
+    The fastest round is compared, as it is the one least disturbed by
+    whatever else the machine was doing.
+    """
+    regressions = []
+    for name, before in baseline["benchmarks"].items():
+        after = results["benchmarks"].get(name)
+        limit = before["min_ms"] * (1 + tolerance) + slack_ms
+        if after and after["min_ms"] > limit:
+            regressions.append(
+                f"{name}: min {after['min_ms']} ms, was {before['min_ms']} ms"
+            )
+    return regressions
+
+
+def parse_args():
+    """Parses the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 10000])
+    parser.add_argument(
+        "--max-rounds", type=int, default=200, help="rounds for the smallest cart"
+    )
+    parser.add_argument("--save", metavar="FILE", help="write the results here")
+    parser.add_argument("--compare", metavar="FILE", help="baseline to check")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="allowed relative increase of the fastest round over the baseline",
+    )
+    parser.add_argument(
+        "--slack-ms",
+        type=float,
+        default=0.05,
+        help="allowed absolute increase, on top of the tolerance",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Runs the micro-benchmarks"""
+    args = parse_args()
+    app.logger.setLevel(logging.CRITICAL)
+    db.session.query(Item).delete()
+    db.session.query(Shopcart).delete()
+    db.session.commit()
+
+    results = {"config": {"database": db.engine.dialect.name}, "benchmarks": {}}
+    print(
+        f"{'benchmark':<45} {'min ms':>10} {'mean ms':>10} {'median ms':>10} "
+        f"{'stddev ms':>10} {'rounds':>7}"
+    )
+    for cart_name, load, item_count in cases(args.sizes):
+        # fewer rounds for the big carts keep the whole run in minutes
+        rounds = max(5, args.max_rounds // max(1, item_count // 10))
+        for name, (operation, serialized) in OPERATIONS.items():
+            setup = partial(serialize_cart, load) if serialized else load
+            stats = run(operation, setup, rounds)
+            results["benchmarks"][f"{name}[{cart_name}]"] = stats
+            print(
+                f"{name + '[' + cart_name + ']':<45} {stats['min_ms']:>10} "
+                f"{stats['mean_ms']:>10} {stats['median_ms']:>10} "
+                f"{stats['stddev_ms']:>10} {rounds:>7}"
+            )
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as baseline:
+            json.dump(results, baseline, indent=2)
+            baseline.write("\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            regressions = compare(
+                results, json.load(baseline), args.tolerance, args.slack_ms
+            )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
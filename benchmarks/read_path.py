@@ -0,0 +1,81 @@
+"""
+Read Path Benchmark
+
+Compares the two ways of building the response of GET /api/shopcarts over
+10,000 carts: serializing ORM objects from Shopcart.all(), and the Core
+read path of Shopcart.search() that builds dicts straight from the rows.
+For each, the time, the peak memory and the allocations still alive when
+the response is built are measured with tracemalloc.
+
+Usage:
+  export DATABASE_URI=sqlite:///bench.db
+  python -m benchmarks.read_path --carts 10000 --items 5
+"""
+import argparse
+import gc
+import logging
+import time
+import tracemalloc
+from service import app
+from service.models import db, Shopcart
+from benchmarks.repricing import seed
+
+
+def orm_path():
+    """Builds the list response from ORM objects"""
+    return [shopcart.serialize() for shopcart in Shopcart.all()]
+
+
+def core_path():
+    """Builds the list response from Core rows"""
+    return Shopcart.search()
+
+
+PATHS = {"orm": orm_path, "core": core_path}
+
+
+def measure(path):
+    """Runs path on a fresh session and returns its time and memory use"""
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    response = path()
+    elapsed = time.perf_counter() - start
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    growth = after.compare_to(before, "filename")
+    return {
+        "carts": len(response),
+        "ms": round(elapsed * 1000, 1),
+        "peak_kb": round(peak / 1024),
+        "blocks": sum(stat.count_diff for stat in growth),
+    }
+
+
+def parse_args():
+    """Parses the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--carts", type=int, default=10000, help="carts to seed")
+    parser.add_argument("--items", type=int, default=5, help="items per cart")
+    return parser.parse_args()
+
+
+def main():
+    """Runs the read path benchmark"""
+    args = parse_args()
+    app.logger.setLevel(logging.CRITICAL)
+    seed(args.carts, args.items)
+    print(f"{'path':<6} {'carts':>7} {'ms':>9} {'peak KB':>9} {'live blocks':>12}")
+    for name, path in PATHS.items():
+        stats = measure(path)
+        print(
+            f"{name:<6} {stats['carts']:>7} {stats['ms']:>9} "
+            f"{stats['peak_kb']:>9} {stats['blocks']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Repricing Benchmark
+
+Times recomputing the total_price of every cart, as a repricing job does,
+over growing numbers of carts. The totals are recomputed once by loading
+the carts and calling Shopcart.get_total_price() on each, and once in SQL
+with Shopcart.refresh_totals(). The time per cart should stay flat as the
+number of carts grows, and the run fails when it grows by more than
+--max-growth times between the smallest and the largest run.
+
+Usage:
+  export DATABASE_URI=sqlite:///bench.db
+  python -m benchmarks.repricing
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+from service import app
+from service.models import db, Shopcart, Item
+
+
+def seed(cart_count, item_count):
+    """Replaces the data with cart_count carts of item_count items each"""
+    db.session.query(Item).delete()
+    db.session.query(Shopcart).delete()
+    now = datetime.now()
+    db.session.execute(
+        db.insert(Shopcart),
+        [
+            {"customer_id": cart, "creation_time": now, "last_updated_time": now}
+            for cart in range(cart_count)
+        ],
+    )
+    cart_ids = db.session.scalars(db.select(Shopcart.id)).all()
+    db.session.execute(
+        db.insert(Item),
+        [
+            {
+                "shopcart_id": cart_id,
+                "name": f"item {number}",
+                "price": Decimal(random.randint(1, 100000)) / 100,
+                "description": "",
+                "quantity": random.randint(1, 10),
+            }
+            for cart_id in cart_ids
+            for number in range(item_count)
+        ],
+    )
+    db.session.commit()
+    db.session.remove()
+    return cart_ids
+
+
+def reprice_in_python(cart_ids):  # pylint: disable=unused-argument
+    """Loads every cart with its items and adds up the total in Python"""
+    for shopcart in Shopcart.all():
+        shopcart.total_price = shopcart.get_total_price()
+    db.session.commit()
+
+
+def reprice_in_sql(cart_ids):
+    """Recomputes every total with one set based UPDATE"""
+    Shopcart.refresh_totals(cart_ids)
+
+
+STRATEGIES = {"python": reprice_in_python, "sql": reprice_in_sql}
+
+
+def parse_args():
+    """Parses the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--items", type=int, default=10, help="items per cart")
+    parser.add_argument(
+        "--max-growth",
+        type=float,
+        default=3.0,
+        help="allowed growth of the time per cart from the smallest run",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Runs the repricing benchmark"""
+    args = parse_args()
+    app.logger.setLevel(logging.CRITICAL)
+    logging.getLogger("flask.app").setLevel(logging.CRITICAL)
+    random.seed(0)
+    per_cart = {name: [] for name in STRATEGIES}
+    print(f"{'strategy':<10} {'carts':>8} {'total ms':>10} {'us per cart':>12}")
+    for cart_count in args.sizes:
+        cart_ids = seed(cart_count, args.items)
+        for name, reprice in STRATEGIES.items():
+            db.session.remove()
+            start = time.perf_counter()
+            reprice(cart_ids)
+            elapsed = time.perf_counter() - start
+            per_cart[name].append(elapsed / cart_count)
+            print(
+                f"{name:<10} {cart_count:>8} {elapsed * 1000:>10.1f} "
+                f"{elapsed / cart_count * 1e6:>12.1f}"
+            )
+
+    failed = False
+    for name, timings in per_cart.items():
+        growth = timings[-1] / timings[0]
+        print(f"{name}: time per cart grew {growth:.2f}x")
+        if growth > args.max_growth:
+            print(f"REGRESSION {name}: repricing does not scale linearly")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Serialization Benchmark
+
+Compares the CPU time spent building a Shopcart response body the way the
+write endpoints used to, serialize() followed by flask-restx marshal_with,
+against the compiled serializer on its own.
+
+Usage:
+  DATABASE_URI=sqlite:///bench.db python -m benchmarks.serialization
+"""
+import argparse
+import time
+from flask_restx import marshal
+from service.models import compile_serializer, Shopcart
+from service.routes import shopcarts_model
+from tests.factories import ShopcartFactory, ItemFactory
+
+
+def cpu_per_call(func, shopcart, rounds):
+    """Returns the average CPU seconds of one call to func(shopcart)"""
+    start = time.process_time()
+    for _ in range(rounds):
+        func(shopcart)
+    return (time.process_time() - start) / rounds
+
+
+def marshal_serialized(shopcart):
+    """The response body as the endpoints built it with marshal_with"""
+    return marshal(shopcart.serialize(), shopcarts_model)
+
+
+def make_shopcart(item_count):
+    """Builds an in-memory Shopcart with item_count Items"""
+    items = [ItemFactory(shopcart_id=1) for _ in range(item_count)]
+    return ShopcartFactory(id=1, items=items)
+
+
+def main():
+    """Runs the benchmark and prints one line per cart size"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    serialize = compile_serializer(Shopcart)
+    print(f"{'items':>8} {'before (us)':>12} {'after (us)':>12} {'speedup':>8}")
+    for item_count in args.items:
+        shopcart = make_shopcart(item_count)
+        before = cpu_per_call(marshal_serialized, shopcart, args.rounds)
+        after = cpu_per_call(serialize, shopcart, args.rounds)
+        print(
+            f"{item_count:>8} {before * 1e6:>12.1f} {after * 1e6:>12.1f} "
+            f"{before / after:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
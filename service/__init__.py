@@ -9,12 +9,15 @@ import sys
 from flask import Flask
 from flask_restx import Api
 from service import config
-from service.common import log_handlers
+from service.common import events, log_handlers, replicas
+from service.common.admission import AdmissionController
 
 # Create Flask application
 app = Flask(__name__)
 app.url_map.strict_slashes = False
 app.config.from_object(config)
+if app.config["ADMISSION_CONTROL"]:
+    app.wsgi_app = AdmissionController(app.wsgi_app, app.config)
 
 ######################################################################
 # Configure Swagger before initializing it
@@ -32,10 +35,11 @@ api = Api(
 
 # Dependencies require we import the routes AFTER the Flask app is created
 # pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
-from service import routes, models  # noqa: E402, E261
+from service import routes, sync_routes, models  # noqa: E402, E261
 
 # pylint: disable=wrong-import-position
 from service.common import error_handlers, cli_commands  # noqa: F401, E402
+from service.common import content_negotiation, shards  # noqa: F401, E402
 
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
@@ -46,6 +50,9 @@ app.logger.info(70 * "*")
 
 try:
     models.init_db(app)  # make our SQLAlchemy tables
+    replicas.init_replicas(app)
+    shards.init_shards(app)
+    events.init_events(app)
 except Exception as error:  # pylint: disable=broad-except
     app.logger.critical("%s: Cannot continue", error)
     # gunicorn requires exit code 4 to stop spawning workers when they die
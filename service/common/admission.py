@@ -0,0 +1,119 @@
+"""
+Admission Control
+
+This module wraps the WSGI app of the service in an admission controller
+that limits the API requests in flight in a worker. The limit adapts to
+the latency of the requests with AIMD: it grows by one while requests are
+fast and the limit is in use, and shrinks by a factor when a request takes
+longer than the target, as it does when the database slows down.
+
+Requests over the limit are answered with 503 Service Unavailable and a
+Retry-After header before they reach the routes or the database. Writes
+may use the whole limit, reads less of it and list scans the least, so
+scans are shed first and writes last.
+"""
+import json
+import logging
+import threading
+import time
+from werkzeug.wrappers import Response
+from service.common import status
+
+logger = logging.getLogger("flask.app")
+
+# Share of the limit that each priority of request may use
+PRIORITY_SHARES = {"write": 1.0, "read": 0.8, "scan": 0.5}
+
+# Only the requests of the API are limited, so probes always get through
+API_PREFIX = "/api/"
+
+
+def priority(environ):
+    """Returns the priority of a request: write, read or scan"""
+    method = environ["REQUEST_METHOD"]
+    path = environ.get("PATH_INFO", "")
+    if path.endswith(":batchGet") or (
+        method == "GET" and path.rstrip("/") == "/api/shopcarts"
+    ):
+        return "scan"
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    return "write"
+
+
+class AimdLimit:
+    """A concurrency limit with additive increase, multiplicative decrease"""
+
+    def __init__(self, initial, minimum, maximum, target, backoff=0.9):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.backoff = backoff
+
+    def update(self, seconds, inflight):
+        """Adapts the limit to a request that took seconds with inflight running"""
+        if seconds > self.target:
+            self.limit = max(self.minimum, self.limit * self.backoff)
+        elif inflight * 2 >= self.limit:
+            self.limit = min(self.maximum, self.limit + 1)
+
+
+class AdmissionController:
+    """WSGI middleware that sheds the API requests over an AimdLimit"""
+
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app = wsgi_app
+        self.limit = AimdLimit(
+            config["ADMISSION_INITIAL_LIMIT"],
+            config["ADMISSION_MIN_LIMIT"],
+            config["ADMISSION_MAX_LIMIT"],
+            config["ADMISSION_TARGET_MS"] / 1000,
+        )
+        self.retry_after = config["ADMISSION_RETRY_AFTER"]
+        self.inflight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if not environ.get("PATH_INFO", "").startswith(API_PREFIX):
+            return self.wsgi_app(environ, start_response)
+        share = PRIORITY_SHARES[priority(environ)]
+        with self._lock:
+            admitted = self.inflight < max(1, self.limit.limit * share)
+            if admitted:
+                self.inflight += 1
+                inflight = self.inflight
+            else:
+                self.rejected += 1
+        if not admitted:
+            return self.reject(environ, start_response)
+
+        start = time.monotonic()
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            with self._lock:
+                self.inflight -= 1
+                self.limit.update(time.monotonic() - start, inflight)
+
+    def reject(self, environ, start_response):
+        """Answers a request over the limit with 503 and Retry-After"""
+        logger.warning(
+            "Shedding %s %s over the limit of %.0f requests",
+            environ["REQUEST_METHOD"],
+            environ.get("PATH_INFO", ""),
+            self.limit.limit,
+        )
+        body = {
+            "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "error": "Service Unavailable",
+            "message": "The service is overloaded, retry later",
+        }
+        response = Response(
+            json.dumps(body),
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            {"Retry-After": str(self.retry_after)},
+            mimetype="application/json",
+        )
+        return response(environ, start_response)
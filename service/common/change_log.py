@@ -0,0 +1,161 @@
+"""
+Change Log
+
+This module keeps a compacted log of the changes to the Items of each
+Shopcart, so clients can sync a cart by asking only for what changed since
+the version they have. Each new version is also published as a changed
+event of the cart.
+
+The mutation paths note the Items they change with note_item_change(). When
+the transaction commits, each changed Shopcart gets its version bumped once,
+and each changed Item gets its row in the item_change table set to that
+version, in the same transaction. The log is compacted as it is written: an
+Item has a single row with its latest version, and a removed Item keeps a
+tombstone row until its cart is deleted.
+"""
+import logging
+from sqlalchemy import event
+from service.common.events import note_event
+from service.common.replicas import RoutingSession
+from service.models import db, Shopcart, Item, UPSERT_INSERTS, compile_row_serializer
+
+logger = logging.getLogger("flask.app")
+
+# Columns of the Items returned with the changes
+ITEM_FIELDS = Item.serializable_fields
+
+
+class ItemChange(db.Model):
+    """The latest change of an Item of a Shopcart"""
+
+    __tablename__ = "item_change"
+    shopcart_id = db.Column(
+        db.Integer,
+        db.ForeignKey("shopcart.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    # not a foreign key, so the row outlives a removed Item as its tombstone
+    item_id = db.Column(db.Integer, primary_key=True)
+    # the version of the cart that first had the Item
+    added_version = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    removed = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (db.Index("ix_item_change_version", "shopcart_id", "version"),)
+
+
+@event.listens_for(RoutingSession, "before_commit")
+def record_changes(session):
+    """Bumps the versions of the changed Shopcarts and logs their Items"""
+    notes = session.info.pop("item_changes", None)
+    if not notes:
+        return
+    # new Items get their ids, and removed ones are gone, before logging
+    session.flush()
+    changes = {}
+    for shopcart_id, item, removed in notes:
+        changes.setdefault(shopcart_id, {})[getattr(item, "id", item)] = removed
+    versions = dict(
+        session.execute(
+            db.update(Shopcart)
+            .where(Shopcart.id.in_(list(changes)))
+            .values(version=Shopcart.version + 1)
+            .returning(Shopcart.id, Shopcart.version),
+            execution_options={"synchronize_session": "fetch"},
+        ).all()
+    )
+    for shopcart_id, version in versions.items():
+        note_event(session, shopcart_id, "changed", version)
+    rows = [
+        {
+            "shopcart_id": shopcart_id,
+            "item_id": item_id,
+            "added_version": versions[shopcart_id],
+            "version": versions[shopcart_id],
+            "removed": removed,
+        }
+        for shopcart_id, items in changes.items()
+        if shopcart_id in versions
+        for item_id, removed in items.items()
+    ]
+    if not rows:
+        return
+    logger.info("Logging %d item changes of %d carts", len(rows), len(versions))
+    insert = UPSERT_INSERTS[db.engine.dialect.name](ItemChange).values(rows)
+    session.execute(
+        insert.on_conflict_do_update(
+            index_elements=[ItemChange.shopcart_id, ItemChange.item_id],
+            set_={
+                "version": insert.excluded.version,
+                "removed": insert.excluded.removed,
+                # an id that comes back after a tombstone is a new Item
+                "added_version": db.case(
+                    (ItemChange.removed, insert.excluded.added_version),
+                    else_=ItemChange.added_version,
+                ),
+            },
+        )
+    )
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def forget_changes(session, previous_transaction):  # pylint: disable=unused-argument
+    """Drops the notes of changes that were rolled back"""
+    session.info.pop("item_changes", None)
+
+
+def changes_since(shopcart, since):
+    """
+    Returns the changes to the Items of a Shopcart after a version
+
+    The changes come from one SELECT of the log rows newer than since,
+    joined to the Items that still exist. A since that is not a version of
+    the cart gets all of its Items as added instead, with reset set, so the
+    client replaces what it has.
+
+    Args:
+        shopcart (Shopcart): the cart, with its id and version loaded
+        since (int): the version that the client has
+
+    Returns:
+        dict: the version of the cart and its added, updated and removed Items
+    """
+    changes = {
+        "shopcart_id": shopcart.id,
+        "version": shopcart.version,
+        "since": since,
+        "reset": since > shopcart.version,
+        "added": [],
+        "updated": [],
+        "removed": [],
+    }
+    if changes["reset"]:
+        changes["added"] = Item.search(shopcart.id)
+        return changes
+    rows = db.session.execute(
+        db.select(
+            ItemChange.item_id,
+            ItemChange.added_version,
+            ItemChange.removed,
+            *(Item.__table__.c[name] for name in ITEM_FIELDS),
+        )
+        .outerjoin(
+            Item,
+            db.and_(
+                Item.id == ItemChange.item_id,
+                Item.shopcart_id == ItemChange.shopcart_id,
+            ),
+        )
+        .where(ItemChange.shopcart_id == shopcart.id, ItemChange.version > since)
+        .order_by(ItemChange.version, ItemChange.item_id)
+    )
+    serialize = compile_row_serializer(Item, ITEM_FIELDS)
+    for row in rows:
+        if row.removed or row.id is None:
+            # an Item added and removed since then never reached the client
+            if row.added_version <= since:
+                changes["removed"].append(row.item_id)
+        else:
+            kind = "added" if row.added_version > since else "updated"
+            changes[kind].append(serialize(row[3:]))
+    return changes
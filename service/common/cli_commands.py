@@ -1,8 +1,15 @@
 """
 Flask CLI Command Extensions
 """
+import csv
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+import click
 from service import app
-from service.models import db
+from service.common import idempotency
+from service.common.shards import each_shard
+from service.models import db, Shopcart, Item, DataValidationError, to_money
 
 
 ######################################################################
@@ -19,3 +26,134 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+def run_batches(batch, batch_size, rate):
+    """
+    Calls batch(batch_size) until it processes less than a full batch
+
+    At most rate batches are started per second, and progress is reported
+    after each one.
+
+    Returns:
+        int: the number of rows processed
+    """
+    total = batches = 0
+    start = time.monotonic()
+    while True:
+        batch_start = time.monotonic()
+        count = batch(batch_size)
+        total += count
+        batches += 1
+        elapsed = time.monotonic() - start
+        click.echo(
+            f"Batch {batches}: {count} rows, {total} in total, "
+            f"{total / elapsed if elapsed else 0:.1f} rows/s"
+        )
+        if count < batch_size:
+            return total
+        time.sleep(max(0.0, 1 / rate - (time.monotonic() - batch_start)))
+
+
+######################################################################
+# Command to delete abandoned shopcarts
+# Usage:
+#   flask sweep-carts --days 90 --batch-size 500 --rate 2
+######################################################################
+@app.cli.command("sweep-carts")
+@click.option(
+    "--days", default=90, show_default=True, help="Age of the carts to delete"
+)
+@click.option(
+    "--batch-size", default=500, show_default=True, help="Carts per transaction"
+)
+@click.option("--rate", default=2.0, show_default=True, help="Most batches per second")
+def sweep_carts(days, batch_size, rate):
+    """Deletes shopcarts not updated for a number of days, in batches"""
+    cutoff = datetime.now() - timedelta(days=days)
+    total = sum(
+        run_batches(
+            lambda limit: Shopcart.delete_stale(cutoff, limit), batch_size, rate
+        )
+        for _ in each_shard()
+    )
+    click.echo(f"Deleted {total} shopcarts last updated before {cutoff}")
+
+
+######################################################################
+# Command to move old shopcarts to the archive tables
+# Usage:
+#   flask archive-carts --days 365 --batch-size 500 --rate 2
+######################################################################
+@app.cli.command("archive-carts")
+@click.option(
+    "--days", default=365, show_default=True, help="Age of the carts to archive"
+)
+@click.option(
+    "--batch-size", default=500, show_default=True, help="Carts per transaction"
+)
+@click.option("--rate", default=2.0, show_default=True, help="Most batches per second")
+def archive_carts(days, batch_size, rate):
+    """Moves shopcarts created a number of days ago to the archive, in batches"""
+    cutoff = datetime.now() - timedelta(days=days)
+    total = sum(
+        run_batches(lambda limit: Shopcart.archive_old(cutoff, limit), batch_size, rate)
+        for _ in each_shard()
+    )
+    click.echo(f"Archived {total} shopcarts created before {cutoff}")
+
+
+######################################################################
+# Command to delete expired Idempotency-Keys
+# Usage:
+#   flask sweep-idempotency-keys --batch-size 1000 --rate 2
+######################################################################
+@app.cli.command("sweep-idempotency-keys")
+@click.option(
+    "--batch-size", default=1000, show_default=True, help="Keys per transaction"
+)
+@click.option("--rate", default=2.0, show_default=True, help="Most batches per second")
+def sweep_idempotency_keys(batch_size, rate):
+    """Deletes the Idempotency-Keys older than IDEMPOTENCY_TTL_SECONDS"""
+    total = run_batches(idempotency.sweep, batch_size, rate)
+    click.echo(f"Deleted {total} expired Idempotency-Keys")
+
+
+######################################################################
+# Command to reprice items from a price feed
+# Usage:
+#   flask reprice prices.csv --batch-size 1000 --rate 2
+######################################################################
+def parse_prices(rows):
+    """Turns name,price rows of a price feed into a dict of Decimal prices"""
+    prices = {}
+    for row in rows:
+        try:
+            prices[row["name"]] = to_money(row["price"])
+        except (KeyError, DataValidationError) as error:
+            raise click.ClickException(
+                f"Price feed row is not name,price: {row}"
+            ) from error
+    return prices
+
+
+@app.cli.command("reprice")
+@click.argument("feed", type=click.File("r", encoding="utf-8"))
+@click.option(
+    "--batch-size", default=1000, show_default=True, help="Prices per transaction"
+)
+@click.option("--rate", default=2.0, show_default=True, help="Most batches per second")
+def reprice(feed, batch_size, rate):
+    """Updates item prices from a CSV feed with name and price columns"""
+    reader = csv.DictReader(feed)
+    repriced = []
+
+    def batch(limit):
+        rows = list(islice(reader, limit))
+        if rows:
+            prices = parse_prices(rows)
+            repriced.extend(Item.reprice(prices) for _ in each_shard())
+        return len(rows)
+
+    total = run_batches(batch, batch_size, rate)
+    click.echo(f"Read {total} prices and repriced {sum(repriced)} items")
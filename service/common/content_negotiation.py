@@ -0,0 +1,126 @@
+"""
+Content Negotiation
+
+This module adds the alternate representations of the API resources and
+compresses response bodies, both negotiated from the request headers
+"""
+import gzip
+import zlib
+import msgpack
+from flask import make_response, request
+from flask_restx.representations import output_json as restx_output_json
+from service import app, api
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Media types worth compressing, matched as prefixes of the mimetype
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    MSGPACK_MEDIA_TYPE,
+    "application/javascript",
+    "text/",
+)
+
+# Content codings we can produce, in order of preference
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+
+######################################################################
+# Alternate representations
+######################################################################
+# The representation is picked by the Accept header, so a cache must not give
+# the response of one to a client that asked for another
+@api.representation("application/json")
+def output_json(data, code, headers=None):
+    """Makes a Flask response with a JSON body"""
+    resp = restx_output_json(data, code, headers)
+    resp.vary.add("Accept")
+    return resp
+
+
+@api.representation(MSGPACK_MEDIA_TYPE)
+def output_msgpack(data, code, headers=None):
+    """Makes a Flask response with a MessagePack encoded body"""
+    resp = make_response(msgpack.packb(data), code)
+    resp.headers.extend(headers or {})
+    resp.vary.add("Accept")
+    return resp
+
+
+######################################################################
+# Compression
+######################################################################
+def compress(data, encoding):
+    """Compresses a whole response body"""
+    if encoding == "br":
+        return brotli.compress(data, quality=app.config["COMPRESS_BR_LEVEL"])
+    return gzip.compress(data, compresslevel=app.config["COMPRESS_LEVEL"])
+
+
+def stream_compress(chunks, encoding, br_level=None, level=None):
+    """
+    Compresses a stream of byte chunks
+
+    Each chunk is flushed through the compressor as soon as it arrives so
+    that a client reading a streamed response is never left waiting on
+    data held back in the compressor
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=br_level)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        # wbits of 16 + MAX_WBITS writes a gzip header and trailer
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+def is_compressible(response):
+    """Checks if a response body may be compressed at all"""
+    return (
+        response.status_code in (200, 201)
+        and "Content-Encoding" not in response.headers
+        and response.mimetype.startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+@app.after_request
+def compress_response(response):
+    """Compresses the response body with an encoding the client accepts"""
+    if not is_compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if not encoding:
+        return response
+
+    if response.is_streamed or response.direct_passthrough:
+        # the length is unknown up front, so compress as the body streams out
+        response.response = stream_compress(
+            response.iter_encoded(),
+            encoding,
+            app.config["COMPRESS_BR_LEVEL"],
+            app.config["COMPRESS_LEVEL"],
+        )
+        response.direct_passthrough = False
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        response.set_data(compress(data, encoding))
+
+    etag, _ = response.get_etag()
+    if etag:
+        # the compressed bytes are not the ones the strong ETag was made for
+        response.set_etag(etag, weak=True)
+    response.headers["Content-Encoding"] = encoding
+    return response
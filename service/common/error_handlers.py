@@ -22,7 +22,7 @@ Module: error_handlers
 
 from flask import jsonify
 from service.models import DataValidationError
-from service import app
+from service import app, api
 from . import status
 
 
@@ -35,6 +35,18 @@ def request_validation_error(error):
     return bad_request(error)
 
 
+@api.errorhandler(DataValidationError)
+def api_validation_error(error):
+    """Handles Value Errors from bad data in the API, which Flask-RESTX catches first"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        "status": status.HTTP_400_BAD_REQUEST,
+        "error": "Bad Request",
+        "message": message,
+    }, status.HTTP_400_BAD_REQUEST
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
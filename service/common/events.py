@@ -0,0 +1,295 @@
+"""
+Shopcart Events
+
+This module pushes the changes of a Shopcart to the clients that follow it
+with Server-Sent Events, instead of having them poll.
+
+Writes note their events with note_event(), and the events are published
+when the transaction commits, never for one that rolls back. On PostgreSQL
+they are published with NOTIFY, and each worker has a single connection
+that LISTENs and fans the events out to the streams of its own subscribers,
+so a subscriber does not hold a database connection. Other databases use
+an in-process bus that only reaches the subscribers of the same worker,
+which is what the tests run on.
+"""
+import json
+import logging
+import queue
+import select
+import threading
+import time
+import sqlalchemy as sa
+from flask import Response, current_app, has_app_context
+from sqlalchemy import event
+from service.common.replicas import RoutingSession
+
+logger = logging.getLogger("flask.app")
+
+# The NOTIFY channel of the events
+CHANNEL = "shopcart_events"
+
+# Events kept for a subscriber that reads slowly, the oldest are dropped
+QUEUE_SIZE = 32
+
+# Seconds that the listener waits for a notification before looking again
+POLL_SECONDS = 5.0
+
+# Seconds between two attempts to reconnect the listener
+RECONNECT_SECONDS = 1.0
+
+
+def note_event(session, shopcart_id, name, version=None):
+    """
+    Notes an event of a Shopcart, to be published when the session commits
+
+    Args:
+        session (Session): the session of the change
+        shopcart_id (int): the id of the Shopcart
+        name (str): changed, updated or deleted
+        version (int): the version of the Shopcart after the change
+    """
+    session.info.setdefault("events", []).append(
+        {"shopcart_id": shopcart_id, "event": name, "version": version}
+    )
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def publish_events(session):
+    """Publishes the events of a transaction once it is committed"""
+    events = session.info.pop("events", None)
+    if events and has_app_context() and "events" in current_app.extensions:
+        current_app.extensions["events"].publish(events)
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def forget_events(session, previous_transaction):  # pylint: disable=unused-argument
+    """Drops the events of a transaction that was rolled back"""
+    session.info.pop("events", None)
+
+
+class LocalBus:
+    """Publishes events to the subscribers of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    @property
+    def subscriber_count(self):
+        """The number of subscriptions of this process"""
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self, shopcart_id):
+        """Returns a new queue that gets the events of a Shopcart"""
+        events = queue.Queue(QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(shopcart_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, shopcart_id, events):
+        """Stops sending the events of a Shopcart to a queue"""
+        with self._lock:
+            queues = self._subscribers.get(shopcart_id, set())
+            queues.discard(events)
+            if not queues:
+                self._subscribers.pop(shopcart_id, None)
+
+    def deliver(self, message):
+        """Puts an event on the queues of the subscribers of its Shopcart"""
+        shopcart_id = message.get("shopcart_id")
+        with self._lock:
+            if shopcart_id is None:
+                queues = set().union(*self._subscribers.values())
+            else:
+                queues = set(self._subscribers.get(shopcart_id, ()))
+        for events in queues:
+            while True:
+                try:
+                    events.put_nowait(message)
+                    break
+                except queue.Full:
+                    # the newest event has the latest version, so it wins
+                    try:
+                        events.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def publish(self, messages):
+        """Publishes the events of a committed transaction"""
+        for message in messages:
+            self.deliver(message)
+
+    def close(self):
+        """Releases what the bus holds"""
+
+
+class PostgresBus(LocalBus):
+    """
+    Publishes events with NOTIFY, and delivers the ones LISTENed to
+
+    The listener thread and its connection are only started by the first
+    subscriber of the worker.
+    """
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        self._listener = None
+        self._closed = threading.Event()
+
+    def subscribe(self, shopcart_id):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self.listen, name="events-listener", daemon=True
+                )
+                self._listener.start()
+        return super().subscribe(shopcart_id)
+
+    def publish(self, messages):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    sa.select(
+                        *(
+                            sa.func.pg_notify(CHANNEL, json.dumps(message))
+                            for message in messages
+                        )
+                    )
+                )
+        except sa.exc.SQLAlchemyError as error:
+            # the change is committed already, the subscribers catch up later
+            logger.warning("Could not publish %d events: %s", len(messages), error)
+
+    def listen(self):
+        """Delivers the notifications of the channel until the bus is closed"""
+        connected_before = False
+        while not self._closed.is_set():
+            try:
+                self.listen_once(resync=connected_before)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Listening for events failed: %s", error)
+            connected_before = True
+            self._closed.wait(RECONNECT_SECONDS)
+
+    def listen_once(self, resync=False):
+        """LISTENs on one connection until it fails or the bus is closed"""
+        connection = self.engine.raw_connection()
+        # the listener keeps its connection to itself, out of the pool
+        connection.detach()
+        try:
+            driver = connection.driver_connection
+            driver.autocommit = True
+            with driver.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            logger.info("Listening for events on %s", CHANNEL)
+            if resync:
+                # events may have been missed while the listener was down
+                self.deliver({"shopcart_id": None, "event": "resync", "version": None})
+            while not self._closed.is_set():
+                if select.select([driver], [], [], POLL_SECONDS) == ([], [], []):
+                    continue
+                driver.poll()
+                while driver.notifies:
+                    self.deliver(json.loads(driver.notifies.pop(0).payload))
+        finally:
+            connection.close()
+
+    def close(self):
+        self._closed.set()
+
+
+def format_event(message):
+    """Formats an event as a Server-Sent Event"""
+    lines = []
+    if message.get("version") is not None:
+        lines.append(f"id: {message['version']}")
+    lines.append(f"event: {message['event']}")
+    lines.append(f"data: {json.dumps(message)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def stream(events, first=(), heartbeat_seconds=15.0, max_seconds=300.0):
+    """
+    Yields the Server-Sent Events of a subscription
+
+    A comment is sent when there was no event for heartbeat_seconds, so
+    proxies keep the stream open and a gone client is noticed. The stream
+    ends after max_seconds, and the client reconnects with its Last-Event-ID.
+
+    Args:
+        events (Queue): the queue of the subscription
+        first (list): events to send before the ones of the queue
+    """
+    deadline = time.monotonic() + max_seconds
+    # tell the client to reconnect quickly when the stream ends
+    yield "retry: 1000\n\n"
+    for message in first:
+        yield format_event(message)
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        try:
+            message = events.get(timeout=min(heartbeat_seconds, remaining))
+        except queue.Empty:
+            yield ": keepalive\n\n"
+            continue
+        yield format_event(message)
+        if message["event"] == "deleted":
+            return
+
+
+def event_stream(bus, events, shopcart, last_event_id):
+    """
+    Returns the text/event-stream response of a subscription to a Shopcart
+
+    A client whose Last-Event-ID is not the version of the Shopcart missed
+    changes, so it gets a changed event with the version right away. The
+    subscription ends when the response is closed.
+
+    Args:
+        bus (LocalBus): the bus of the subscription
+        events (Queue): the queue of the subscription
+        shopcart (Shopcart): the Shopcart, with its id and version loaded
+        last_event_id (str): the last version the client got, if any
+    """
+    first = []
+    if last_event_id is not None and last_event_id != str(shopcart.version):
+        first.append(
+            {
+                "shopcart_id": shopcart.id,
+                "event": "changed",
+                "version": shopcart.version,
+            }
+        )
+    response = Response(
+        stream(
+            events,
+            first,
+            current_app.config["EVENTS_HEARTBEAT_SECONDS"],
+            current_app.config["EVENTS_MAX_SECONDS"],
+        ),
+        mimetype="text/event-stream",
+        # proxies must pass each event on as it comes
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(lambda: bus.unsubscribe(shopcart.id, events))
+    return response
+
+
+def get_bus():
+    """Returns the event bus of the app"""
+    return current_app.extensions["events"]
+
+
+def init_events(app):
+    """Sets up the event bus that fits the database of the app"""
+    if "events" in app.extensions:
+        app.extensions["events"].close()
+    with app.app_context():
+        engine = app.extensions["sqlalchemy"].engine
+        bus = PostgresBus(engine) if engine.dialect.name == "postgresql" else LocalBus()
+    app.extensions["events"] = bus
+    logger.info("Publishing shopcart events with %s", type(bus).__name__)
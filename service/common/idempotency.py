@@ -0,0 +1,267 @@
+"""
+Idempotency Keys
+
+This module lets clients retry a POST safely by sending the same
+Idempotency-Key header. The first request with a key claims it and runs,
+and its response is stored with a fingerprint of the request. A retry with
+the key gets the stored response back without running the write again, and
+a retry that arrives while the first request still runs waits for it.
+
+The keys are stored in the idempotency_key table of the main database,
+outside of the session of the request, and expire after
+IDEMPOTENCY_TTL_SECONDS. While the first request runs, its claim is renewed
+every third of IDEMPOTENCY_LEASE_SECONDS, and only a claim that was not
+renewed for a whole lease is taken over, as the one of a dead worker.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import abort, current_app, request
+from sqlalchemy.exc import IntegrityError
+from service.common import status
+from service.models import db
+
+logger = logging.getLogger("flask.app")
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Seconds between two looks at a key that another request is working on
+POLL_SECONDS = 0.05
+
+
+class IdempotencyKey(db.Model):
+    """A claimed Idempotency-Key and, once the request is done, its response"""
+
+    __tablename__ = "idempotency_key"
+    key = db.Column(db.String(MAX_KEY_LENGTH), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    response = db.Column(db.Text)
+    # the time of the claim, renewed while the request runs
+    created_time = db.Column(db.DateTime(), nullable=False, index=True)
+
+
+def fingerprint():
+    """Returns a hash of the method, path and body of the request"""
+    digest = hashlib.sha256()
+    for part in (request.method, request.path):
+        digest.update(part.encode() + b"\0")
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def claim(key, request_hash):
+    """
+    Claims a key for the request, or returns the record of the key
+
+    Returns:
+        Row: None when the key was claimed, else the record that holds it
+    """
+    table = IdempotencyKey.__table__
+    now = datetime.now()
+    expired = now - timedelta(seconds=current_app.config["IDEMPOTENCY_TTL_SECONDS"])
+    # a claim that its request stopped renewing was left by a dead worker
+    abandoned = now - timedelta(seconds=current_app.config["IDEMPOTENCY_LEASE_SECONDS"])
+    with db.engine.begin() as conn:
+        conn.execute(
+            table.delete().where(
+                table.c.key == key,
+                db.or_(
+                    table.c.created_time < expired,
+                    db.and_(
+                        table.c.status_code.is_(None),
+                        table.c.created_time < abandoned,
+                    ),
+                ),
+            )
+        )
+    while True:
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(
+                    table.insert().values(
+                        key=key, fingerprint=request_hash, created_time=now
+                    )
+                )
+            return None
+        except IntegrityError:
+            with db.engine.connect() as conn:
+                record = conn.execute(table.select().where(table.c.key == key)).first()
+            if record is not None:
+                return record
+            # the request that held the key released it in between, try again
+
+
+def wait_for(key, record):
+    """
+    Waits until the request that holds a key stores its response
+
+    Returns:
+        Row: the record with the response, or None if the request released
+        the key
+    """
+    table = IdempotencyKey.__table__
+    deadline = time.monotonic() + current_app.config["IDEMPOTENCY_WAIT_SECONDS"]
+    while record is not None and record.status_code is None:
+        if time.monotonic() > deadline:
+            abort(
+                status.HTTP_409_CONFLICT,
+                f"The request with {HEADER} '{key}' is still in progress.",
+            )
+        time.sleep(POLL_SECONDS)
+        with db.engine.connect() as conn:
+            record = conn.execute(table.select().where(table.c.key == key)).first()
+    return record
+
+
+class Lease:
+    """
+    Renews the claim of a key until the request that holds it is done
+
+    A thread of the worker renews the claim, so a slow request keeps its key
+    however long it runs, and the claim lapses only when the worker dies.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.app = current_app._get_current_object()  # pylint: disable=protected-access
+        self.seconds = self.app.config["IDEMPOTENCY_LEASE_SECONDS"] / 3
+        self._done = threading.Event()
+        self._thread = threading.Thread(
+            target=self.renew_until_done, name="idempotency-lease", daemon=True
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        self._thread.join()
+
+    def renew_until_done(self):
+        """Renews the claim every third of the lease"""
+        table = IdempotencyKey.__table__
+        with self.app.app_context():
+            while not self._done.wait(self.seconds):
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(
+                            table.update()
+                            .where(
+                                table.c.key == self.key,
+                                table.c.status_code.is_(None),
+                            )
+                            .values(created_time=datetime.now())
+                        )
+                except Exception as error:  # pylint: disable=broad-except
+                    logger.warning(
+                        "Could not renew %s '%s': %s", HEADER, self.key, error
+                    )
+
+
+def acquire(key, request_hash):
+    """
+    Claims a key, or waits for the response of the request that holds it
+
+    A request that fails releases its key, and then the waiters compete to
+    claim it again, so only one of them runs the write.
+
+    Returns:
+        Row: None when the key was claimed, else the record with the response
+    """
+    while True:
+        record = claim(key, request_hash)
+        if record is None:
+            return None
+        record = wait_for(key, record)
+        if record is not None:
+            return record
+
+
+def store(key, result):
+    """Stores the response of the request that claimed a key"""
+    body, code, headers = (tuple(result) + (None, None))[:3]
+    table = IdempotencyKey.__table__
+    with db.engine.begin() as conn:
+        conn.execute(
+            table.update()
+            .where(table.c.key == key)
+            .values(status_code=code, response=json.dumps([body, headers or {}]))
+        )
+
+
+def release(key):
+    """Gives up the claim of a key, so the request can be retried"""
+    table = IdempotencyKey.__table__
+    with db.engine.begin() as conn:
+        conn.execute(table.delete().where(table.c.key == key))
+
+
+def idempotent(func):
+    """
+    Makes a POST resource honor the Idempotency-Key header
+
+    The resource must return a (body, status) or (body, status, headers)
+    tuple. If it raises, the key is released and a retry runs again.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return func(*args, **kwargs)
+        if not 0 < len(key) <= MAX_KEY_LENGTH:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"{HEADER} must have 1 to {MAX_KEY_LENGTH} characters.",
+            )
+        request_hash = fingerprint()
+        record = acquire(key, request_hash)
+        if record is None:
+            try:
+                with Lease(key):
+                    result = func(*args, **kwargs)
+            except BaseException:
+                release(key)
+                raise
+            store(key, result)
+            return result
+
+        if record.fingerprint != request_hash:
+            abort(
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+                f"{HEADER} '{key}' was already used for another request.",
+            )
+        logger.info("Replaying the response of %s '%s'", HEADER, key)
+        body, headers = json.loads(record.response)
+        return body, record.status_code, dict(headers, **{REPLAYED_HEADER: "true"})
+
+    return wrapper
+
+
+def sweep(limit):
+    """
+    Deletes one batch of expired keys
+
+    Returns:
+        int: the number of keys deleted
+    """
+    table = IdempotencyKey.__table__
+    expired = datetime.now() - timedelta(
+        seconds=current_app.config["IDEMPOTENCY_TTL_SECONDS"]
+    )
+    with db.engine.begin() as conn:
+        keys = (
+            db.select(table.c.key)
+            .where(table.c.created_time < expired)
+            .order_by(table.c.created_time)
+            .limit(limit)
+        )
+        return conn.execute(table.delete().where(table.c.key.in_(keys))).rowcount
@@ -0,0 +1,74 @@
+"""
+Readiness
+
+This module decides if a worker is ready for more traffic. It is not when
+getting a database connection from the pool takes too long, when the ping
+of the database is slow or fails, or when too many API requests are in
+flight. The database check is cached for a few seconds so the probes do
+not add load to a database that is already struggling.
+"""
+import logging
+import threading
+import time
+import sqlalchemy as sa
+
+logger = logging.getLogger("flask.app")
+
+
+class ReadinessCheck:
+    """The cached result of checking the database of the service"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = None
+        self._database = {}
+
+    def database(self, engine, cache_seconds):
+        """
+        Returns the pool wait and ping of the database, in milliseconds
+
+        The database is checked at most every cache_seconds. While a check
+        is running, other callers get the last result instead of waiting.
+        """
+        now = time.monotonic()
+        fresh = self._checked is not None and now - self._checked < cache_seconds
+        # pylint: disable-next=consider-using-with
+        if fresh or not self._lock.acquire(blocking=False):
+            return self._database
+        try:
+            self._database = self.ping(engine)
+            self._checked = time.monotonic()
+        finally:
+            self._lock.release()
+        return self._database
+
+    @staticmethod
+    def ping(engine):
+        """Times getting a connection from the pool and a SELECT 1 on it"""
+        start = time.monotonic()
+        try:
+            with engine.connect() as conn:
+                connected = time.monotonic()
+                conn.execute(sa.text("SELECT 1"))
+                done = time.monotonic()
+        except sa.exc.SQLAlchemyError as error:
+            logger.warning("Readiness check of the database failed: %s", error)
+            return {"error": str(error)}
+        return {
+            "pool_wait_ms": round((connected - start) * 1000, 1),
+            "ping_ms": round((done - connected) * 1000, 1),
+        }
+
+
+def not_ready_reasons(checks, config):
+    """Returns why the checks make the worker not ready, empty when ready"""
+    reasons = []
+    if "error" in checks:
+        reasons.append("the database can not be reached")
+    if checks.get("pool_wait_ms", 0) > config["READY_MAX_POOL_WAIT_MS"]:
+        reasons.append("connections wait too long in the pool")
+    if checks.get("ping_ms", 0) > config["READY_MAX_PING_MS"]:
+        reasons.append("the database answers too slowly")
+    if checks.get("inflight", 0) > config["READY_MAX_INFLIGHT"]:
+        reasons.append("too many requests are in flight")
+    return reasons
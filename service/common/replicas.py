@@ -0,0 +1,198 @@
+"""
+Read Replicas
+
+This module sends the reads of GET requests, and of the POST endpoints that
+only read like :batchGet, to read replicas of the database when
+DATABASE_REPLICA_URIS is set. A client that just wrote keeps reading from
+the primary for REPLICA_STICKY_SECONDS so it sees its own writes, and
+replicas that lag or fail are skipped in favor of the primary.
+"""
+import logging
+import math
+import time
+from itertools import cycle
+import sqlalchemy as sa
+from flask import current_app, request
+from flask_sqlalchemy.session import Session
+
+logger = logging.getLogger("flask.app")
+
+# Methods that never write, so they may be served by a replica
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Suffixes of the paths of the POST endpoints that only read
+READ_ONLY_ACTIONS = (":batchGet",)
+
+# Cookie with the time of the last write of a client
+STICKY_COOKIE = "last_write"
+
+# Queries that return the replication lag of a replica in seconds, by
+# dialect. Databases not listed are taken as never lagging.
+LAG_QUERIES = {
+    "postgresql": (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+        "THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM "
+        "now() - pg_last_xact_replay_timestamp()), 0) END"
+    ),
+}
+
+
+class ReplicaSet:
+    """
+    The engines of the read replicas and what is known of their health
+
+    The health of a replica is checked at most every check_seconds, and a
+    replica is healthy when it answers and lags at most max_lag seconds.
+    """
+
+    def __init__(self, uris, max_lag=2.0, check_seconds=5.0):
+        self.engines = [sa.create_engine(uri) for uri in uris]
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        self._status = {}
+        self._next = cycle(self.engines)
+
+    def pick(self):
+        """Returns the next healthy replica, or None to use the primary"""
+        for _ in self.engines:
+            engine = next(self._next)
+            if self.is_healthy(engine):
+                return engine
+        return None
+
+    def is_healthy(self, engine):
+        """Returns the health of a replica, checking it again when it is due"""
+        checked, healthy = self._status.get(engine, (-math.inf, False))
+        now = time.monotonic()
+        if now - checked >= self.check_seconds:
+            healthy = self.check(engine)
+            self._status[engine] = (now, healthy)
+        return healthy
+
+    def check(self, engine):
+        """Checks that a replica answers and does not lag too far behind"""
+        query = sa.text(LAG_QUERIES.get(engine.dialect.name, "SELECT 0"))
+        try:
+            with engine.connect() as conn:
+                lag = conn.execute(query).scalar()
+        except sa.exc.DBAPIError as error:
+            logger.warning("Replica %s is down: %s", engine.url, error)
+            return False
+        if lag > self.max_lag:
+            logger.warning("Replica %s lags %.1f seconds", engine.url, lag)
+            return False
+        return True
+
+    def dispose(self):
+        """Closes the connections to the replicas"""
+        for engine in self.engines:
+            engine.dispose()
+
+    def mark_down(self, engine):
+        """Skips a replica until its next health check"""
+        self._status[engine] = (time.monotonic(), False)
+
+
+class RoutingSession(Session):
+    """
+    Session that reads from the replica in info["replica"], if there is one,
+    and runs everything else on the shard in info["shard"] or the primary
+
+    Flushes and INSERT, UPDATE and DELETE statements never go to a replica.
+    A statement that fails on the replica is run again on the primary for
+    the rest of the session.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get("replica")
+        if bind is not None:
+            return bind
+        if (
+            replica is not None
+            and not self._flushing
+            and not getattr(clause, "is_dml", False)
+        ):
+            return replica
+        if "shard" in self.info:
+            return self.info["shard"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def execute(self, statement, *args, **kwargs):
+        replica = self.info.get("replica")
+        if replica is None:
+            return super().execute(statement, *args, **kwargs)
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except sa.exc.DBAPIError as error:
+            logger.warning("Reading from the primary, replica failed: %s", error)
+            self.info["replica_set"].mark_down(replica)
+            del self.info["replica"]
+            self.rollback()
+            return super().execute(statement, *args, **kwargs)
+
+
+######################################################################
+# Request routing
+######################################################################
+def wrote_recently():
+    """Checks if the client of the request wrote in the sticky window"""
+    try:
+        last_write = float(request.cookies.get(STICKY_COOKIE, "0"))
+    except ValueError:
+        return False
+    return time.time() - last_write < current_app.config["REPLICA_STICKY_SECONDS"]
+
+
+def only_reads():
+    """Checks if the request only reads, by its method or its endpoint"""
+    return request.method in READ_METHODS or request.path.endswith(READ_ONLY_ACTIONS)
+
+
+def route_reads():
+    """Sends the reads of a safe request to a replica"""
+    replicas = current_app.extensions.get("replicas")
+    if not replicas or not only_reads() or wrote_recently():
+        return
+    if current_app.extensions.get("shards"):
+        return  # the replicas are of the database that is not sharded
+    replica = replicas.pick()
+    if replica is not None:
+        session = current_app.extensions["sqlalchemy"].session
+        session.info.update(replica=replica, replica_set=replicas)
+
+
+def remember_writes(response):
+    """Makes the client of a successful write read from the primary a while"""
+    if (
+        current_app.extensions.get("replicas")
+        and not only_reads()
+        and response.status_code < 400
+    ):
+        response.set_cookie(
+            STICKY_COOKIE,
+            f"{time.time():.3f}",
+            max_age=math.ceil(current_app.config["REPLICA_STICKY_SECONDS"]),
+            httponly=True,
+        )
+    return response
+
+
+def init_replicas(app):
+    """Sets up the read replicas listed in DATABASE_REPLICA_URIS"""
+    uris = app.config.get("DATABASE_REPLICA_URIS")
+    if "replicas" not in app.extensions:
+        app.before_request(route_reads)
+        app.after_request(remember_writes)
+    elif app.extensions["replicas"]:
+        app.extensions["replicas"].dispose()
+    app.extensions["replicas"] = (
+        ReplicaSet(
+            uris,
+            app.config["REPLICA_MAX_LAG_SECONDS"],
+            app.config["REPLICA_CHECK_SECONDS"],
+        )
+        if uris
+        else None
+    )
+    if uris:
+        logger.info("Reading from %d replicas", len(uris))
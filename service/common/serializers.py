@@ -0,0 +1,99 @@
+"""
+Serializers
+
+Functions that turn model objects and result rows into the dicts of the API
+schema, and API values into model values. They only rely on the
+serializable_fields and field_converters of a model.
+"""
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from operator import attrgetter
+
+# Serializers kept per model and projection, the least recently used go first
+CACHE_SIZE = 256
+
+# The places of the Numeric(14, 4) money columns
+MONEY_PLACES = Decimal("0.0001")
+
+
+class DataValidationError(Exception):
+    """Used for an data validation errors when deserializing"""
+
+
+def to_money(value):
+    """
+    Converts a price to a Decimal
+
+    Floats go through str(), so 10.99 becomes Decimal("10.99") and not the
+    binary approximation of it. Values that are not Decimals yet are rounded
+    to the MONEY_PLACES that the database keeps, so a write returns the
+    price that it stored. NaN and the infinities are not prices.
+
+    Raises:
+        DataValidationError: when the value is not a finite number
+    """
+    if isinstance(value, Decimal):
+        money = value
+    else:
+        try:
+            money = Decimal(str(value)).quantize(MONEY_PLACES)
+        except InvalidOperation as error:
+            raise DataValidationError(
+                f"Invalid price: {value!r} is not a number"
+            ) from error
+    if not money.is_finite():
+        raise DataValidationError(f"Invalid price: {value!r} is not a finite number")
+    return money
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_serializer(model, fields=None):
+    """
+    Builds the function that serializes instances of a model
+
+    The attribute getters and value converters of each field are looked up
+    once per model and projection, so serializing an object is a single pass
+    that already produces the documented API schema.
+
+    Args:
+        model (class): a PersistentBase subclass
+        fields (tuple): the fields to include, all of them when None
+    """
+    steps = tuple(
+        (name, attrgetter(name), model.field_converters.get(name))
+        for name in fields or model.serializable_fields
+    )
+
+    def serialize(obj):
+        data = {}
+        for name, get, convert in steps:
+            value = get(obj)
+            data[name] = value if convert is None or value is None else convert(value)
+        return data
+
+    return serialize
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_row_serializer(model, names):
+    """
+    Builds the function that turns a result row of the given columns into a dict
+
+    It is the counterpart of compile_serializer() for rows selected with
+    Core, that never become ORM objects.
+
+    Args:
+        model (class): a PersistentBase subclass
+        names (tuple): the names of the columns of the rows, in order
+    """
+    converters = tuple(model.field_converters.get(name) for name in names)
+    if not any(converters):
+        return lambda row: dict(zip(names, row))
+
+    def serialize(row):
+        return {
+            name: value if convert is None or value is None else convert(value)
+            for name, convert, value in zip(names, converters, row)
+        }
+
+    return serialize
@@ -0,0 +1,234 @@
+"""
+Shards
+
+This module spreads the Shopcarts over the databases listed in
+DATABASE_SHARD_URIS. A cart lives on the shard that its customer_id hashes
+to on a consistent hash ring, and takes its id from the id range of that
+shard, so the id alone tells which shard to ask for a cart.
+
+Without DATABASE_SHARD_URIS there is one database, and the functions here
+run everything on it.
+"""
+import hashlib
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import sqlalchemy as sa
+from flask import abort, current_app, request
+from service.common import status
+from service.models import db, Shopcart, Item
+
+# The ids of shard n are in [n * SHARD_ID_RANGE, (n + 1) * SHARD_ID_RANGE),
+# so MAX_SHARDS shards of 134 million carts fit in a 32 bit id
+SHARD_ID_RANGE = 2**27
+MAX_SHARDS = 16
+
+# Points of each shard on the hash ring, so customers spread evenly
+VIRTUAL_NODES = 160
+
+# Statements that make the ids of a table start above :floor, by dialect
+ID_FLOOR_STATEMENTS = {
+    "sqlite": (
+        "UPDATE sqlite_sequence SET seq = :floor WHERE name = :table AND seq < :floor",
+        "INSERT INTO sqlite_sequence (name, seq) SELECT :table, :floor "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :table)",
+    ),
+    "postgresql": (
+        "SELECT setval(pg_get_serial_sequence(:table, 'id'), :floor) "
+        "WHERE COALESCE(pg_sequence_last_value("
+        "CAST(pg_get_serial_sequence(:table, 'id') AS regclass)), 0) < :floor",
+    ),
+}
+
+
+def ring_hash(key):
+    """Hashes a key to a point on the hash ring"""
+    digest = hashlib.blake2b(str(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class ShardMap:
+    """
+    The engines of the shards and the hash ring of customers over them
+
+    Adding a shard to the end of the list only moves the customers that
+    hash to the new shard. Carts that exist keep their shard and their id.
+    """
+
+    def __init__(self, app, uris, virtual_nodes=VIRTUAL_NODES):
+        if not 0 < len(uris) <= MAX_SHARDS:
+            raise ValueError(f"Between 1 and {MAX_SHARDS} shards are supported")
+        self.app = app
+        self.engines = [sa.create_engine(uri) for uri in uris]
+        ring = sorted(
+            (ring_hash(f"{index}-{node}"), index)
+            for index in range(len(uris))
+            for node in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [index for _, index in ring]
+        self._pool = ThreadPoolExecutor(len(uris), thread_name_prefix="shard")
+
+    def for_customer(self, customer_id):
+        """Returns the index of the shard that holds the carts of a customer"""
+        position = bisect(self._points, ring_hash(customer_id))
+        return self._owners[position % len(self._points)]
+
+    def for_id(self, shopcart_id):
+        """Returns the index of the shard of a cart id, None if there is none"""
+        index = shopcart_id // SHARD_ID_RANGE
+        return index if 0 <= index < len(self.engines) else None
+
+    def create_all(self):
+        """Creates the tables on every shard and starts the ids of each shard"""
+        for index, engine in enumerate(self.engines):
+            db.metadata.create_all(engine)
+            if self.app.config.get("UNIQUE_LINE_ITEMS"):
+                Item.unique_name_index().create(engine, checkfirst=True)
+            if index == 0:
+                continue
+            statements = ID_FLOOR_STATEMENTS.get(engine.dialect.name)
+            if not statements:
+                raise ValueError(f"Sharding does not support {engine.dialect.name}")
+            with engine.begin() as conn:
+                for statement in statements:
+                    conn.execute(
+                        sa.text(statement),
+                        {
+                            "table": Shopcart.__tablename__,
+                            "floor": index * SHARD_ID_RANGE,
+                        },
+                    )
+
+    @contextmanager
+    def bound(self, index):
+        """Runs the database work of the with block on one shard"""
+        with self.app.app_context():
+            db.session.info["shard"] = self.engines[index]
+            yield index
+
+    def run(self, func, args_by_shard):
+        """
+        Calls func(*args) on the shards of args_by_shard in parallel
+
+        Returns:
+            list: the results, in the order of the shards
+        """
+
+        def call(index):
+            with self.bound(index):
+                return func(*args_by_shard[index])
+
+        return list(self._pool.map(call, sorted(args_by_shard)))
+
+    def dispose(self):
+        """Stops the workers and closes the connections to the shards"""
+        self._pool.shutdown()
+        for engine in self.engines:
+            engine.dispose()
+
+
+def get_shards():
+    """Returns the ShardMap of the app, None when it is not sharded"""
+    return current_app.extensions.get("shards")
+
+
+def use_customer_shard(customer_id):
+    """Runs the rest of the request on the shard of a customer"""
+    shards = get_shards()
+    if shards:
+        db.session.info["shard"] = shards.engines[shards.for_customer(customer_id)]
+
+
+def same_shard(shopcart_id, other_id):
+    """Checks if two carts are on the same shard"""
+    shards = get_shards()
+    return not shards or shards.for_id(shopcart_id) == shards.for_id(other_id)
+
+
+def owns_customer(shopcart_id, customer_id):
+    """Checks if a cart is on the shard where the carts of a customer go"""
+    shards = get_shards()
+    return not shards or shards.for_id(shopcart_id) == shards.for_customer(customer_id)
+
+
+def fan_out(func, *args, **kwargs):
+    """
+    Calls func on every shard in parallel
+
+    Returns:
+        list: the results, in the order of the shards, that is of the ids
+    """
+    shards = get_shards()
+    if not shards:
+        return [func(*args, **kwargs)]
+    return shards.run(
+        lambda: func(*args, **kwargs),
+        {index: () for index in range(len(shards.engines))},
+    )
+
+
+def fan_out_ids(func, ids, *args):
+    """
+    Calls func(ids, *args) on every shard that can hold some of ids, with
+    just those ids, in parallel
+
+    Returns:
+        list: the results, in the order of the shards
+    """
+    shards = get_shards()
+    if not shards:
+        return [func(ids, *args)]
+    groups = {}
+    for shopcart_id in ids:
+        index = shards.for_id(shopcart_id)
+        if index is not None:
+            groups.setdefault(index, []).append(shopcart_id)
+    return shards.run(func, {index: (group, *args) for index, group in groups.items()})
+
+
+def each_shard():
+    """Yields once for each shard with the session bound to it, or once"""
+    shards = get_shards()
+    if not shards:
+        yield None
+        return
+    for index in range(len(shards.engines)):
+        with shards.bound(index):
+            yield index
+
+
+######################################################################
+# Request routing
+######################################################################
+def route_shard():
+    """Runs a request for one cart or customer on the shard that has it"""
+    shards = get_shards()
+    view_args = request.view_args or {}
+    if not shards:
+        return
+    if "shopcart_id" in view_args:
+        index = shards.for_id(view_args["shopcart_id"])
+        if index is None:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id '{view_args['shopcart_id']}' could not be found.",
+            )
+    elif "customer_id" in view_args:
+        index = shards.for_customer(view_args["customer_id"])
+    else:
+        return
+    db.session.info["shard"] = shards.engines[index]
+
+
+def init_shards(app):
+    """Sets up the shards listed in DATABASE_SHARD_URIS"""
+    uris = app.config.get("DATABASE_SHARD_URIS")
+    if "shards" not in app.extensions:
+        app.before_request(route_shard)
+    elif app.extensions["shards"]:
+        app.extensions["shards"].dispose()
+    app.extensions["shards"] = ShardMap(app, uris) if uris else None
+    if uris:
+        app.extensions["shards"].create_all()
+        app.logger.info("Sharding shopcarts over %d databases", len(uris))
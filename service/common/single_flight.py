@@ -0,0 +1,95 @@
+"""
+Single Flight
+
+This module coalesces identical reads that are in flight at the same time
+in a worker. The first request for a key runs, and the requests for the
+same key that arrive before it finishes wait for it and share its result,
+or its exception, instead of going to the database themselves.
+"""
+import logging
+import threading
+from functools import wraps
+from flask import current_app, request
+from service.common.replicas import STICKY_COOKIE
+
+logger = logging.getLogger("flask.app")
+
+
+class Flight:  # pylint: disable=too-few-public-methods
+    """A call in flight and, once it is done, its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time and shares its outcome
+
+    The leaders counter counts the calls that ran, and the coalesced
+    counter the calls that were answered by one of them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Returns func(), or the outcome of the call for key in flight"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if leader:
+            return self._lead(key, flight, func)
+        logger.debug("Sharing the call in flight for %s", key)
+        return self._share(flight)
+
+    def _lead(self, key, flight, func):
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    @staticmethod
+    def _share(flight):
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+
+# The flights of the reads of this worker
+flights = SingleFlight()
+
+
+def coalesce(func):
+    """
+    Makes concurrent identical GET requests share one call of a resource
+
+    Requests are identical when they have the same path and query string,
+    and the same stickiness to the primary database.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not current_app.config["SINGLE_FLIGHT"]:
+            return func(*args, **kwargs)
+        key = (request.full_path, STICKY_COOKIE in request.cookies)
+        return flights.do(key, lambda: func(*args, **kwargs))
+
+    return wrapper
@@ -14,3 +14,81 @@ SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
+
+# Response compression: bodies smaller than COMPRESS_MIN_SIZE bytes are sent
+# as they are, COMPRESS_LEVEL is the gzip level and COMPRESS_BR_LEVEL the
+# brotli quality
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "500"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_BR_LEVEL = int(os.getenv("COMPRESS_BR_LEVEL", "5"))
+
+# Keep one Item per name in a Shopcart, adding to the quantity of the line
+# that is there instead of adding a second one. Existing duplicates must be
+# merged before turning this on, or the unique index can not be created.
+UNIQUE_LINE_ITEMS = os.getenv("UNIQUE_LINE_ITEMS", "false").lower() == "true"
+
+# The most Shopcarts that one POST /api/shopcarts:batchGet can ask for
+BATCH_GET_MAX_IDS = int(os.getenv("BATCH_GET_MAX_IDS", "100"))
+
+# Read replicas, as a comma separated list of database URIs. GET requests
+# read from them, unless the client wrote in the last REPLICA_STICKY_SECONDS.
+# A replica is checked at most every REPLICA_CHECK_SECONDS and skipped while
+# it lags more than REPLICA_MAX_LAG_SECONDS or does not answer.
+DATABASE_REPLICA_URIS = [
+    uri for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri
+]
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "2"))
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "5"))
+
+# Shards of the shopcarts, as a comma separated list of database URIs. The
+# carts of a customer go to the shard its customer_id hashes to, and new
+# shards must be added at the end of the list.
+DATABASE_SHARD_URIS = [
+    uri for uri in os.getenv("DATABASE_SHARD_URIS", "").split(",") if uri
+]
+
+# Let concurrent identical GET requests of a worker share one database read
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+
+# Admission control of the API requests in flight in a worker. The limit
+# starts at ADMISSION_INITIAL_LIMIT, stays between ADMISSION_MIN_LIMIT and
+# ADMISSION_MAX_LIMIT, and shrinks when a request takes longer than
+# ADMISSION_TARGET_MS. Shed requests are asked to retry after
+# ADMISSION_RETRY_AFTER seconds. A worker never has more requests in flight
+# than the --threads of gunicorn (8), so the limit tops out at that count,
+# and a limit that starts there sheds as soon as requests slow down.
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", "8"))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "8"))
+ADMISSION_TARGET_MS = float(os.getenv("ADMISSION_TARGET_MS", "250"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+# Thresholds of /readyz. The worker is not ready when getting a connection
+# from the pool takes more than READY_MAX_POOL_WAIT_MS, when SELECT 1 takes
+# more than READY_MAX_PING_MS, or when more than READY_MAX_INFLIGHT API
+# requests are in flight. The database is checked every READY_CHECK_SECONDS.
+# At the full limit of 8, reads may use 6.4 of it, so a worker reports that
+# it is not ready from the point where it sheds reads.
+READY_MAX_POOL_WAIT_MS = float(os.getenv("READY_MAX_POOL_WAIT_MS", "100"))
+READY_MAX_PING_MS = float(os.getenv("READY_MAX_PING_MS", "250"))
+READY_MAX_INFLIGHT = int(os.getenv("READY_MAX_INFLIGHT", "6"))
+READY_CHECK_SECONDS = float(os.getenv("READY_CHECK_SECONDS", "5"))
+
+# Responses of POST requests with an Idempotency-Key are kept for
+# IDEMPOTENCY_TTL_SECONDS. A retry waits up to IDEMPOTENCY_WAIT_SECONDS for
+# the first request with its key to finish. The first request renews its
+# claim while it runs, and a claim not renewed for IDEMPOTENCY_LEASE_SECONDS
+# is taken over by a retry.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+
+# Server-Sent Events of the shopcarts. Each stream holds a thread of the
+# worker, so a worker serves at most EVENTS_MAX_SUBSCRIBERS streams. A
+# stream sends a keepalive after EVENTS_HEARTBEAT_SECONDS without events,
+# and ends after EVENTS_MAX_SECONDS for the client to reconnect.
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "4"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_MAX_SECONDS = float(os.getenv("EVENTS_MAX_SECONDS", "300"))
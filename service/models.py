@@ -6,13 +6,24 @@ All of the models are stored in this module
 import logging
 from abc import abstractmethod
 from datetime import datetime
+from decimal import Decimal
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from service.common.replicas import RoutingSession
+from service.common.serializers import (
+    DataValidationError,
+    compile_row_serializer,
+    compile_serializer,
+    to_money,
+)
 
 
 logger = logging.getLogger("flask.app")
 
-# Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# Create the SQLAlchemy object to be initialized later in init_db(). Commits
+# do not expire objects, so writes are serialized without reloading them.
+db = SQLAlchemy(session_options={"expire_on_commit": False, "class_": RoutingSession})
 
 
 # Function to initialize the database
@@ -21,19 +32,98 @@ def init_db(app):
     Shopcart.init_db(app)
 
 
-class DataValidationError(Exception):
-    """Used for an data validation errors when deserializing"""
+def remove_session(exception=None):  # pylint: disable=unused-argument
+    """Ends the session of a request, so its objects are not served again"""
+    db.session.remove()
+
+
+def note_item_change(shopcart_id, item, removed=False):
+    """
+    Notes a change of an Item, for the change log to record when it commits
+
+    Args:
+        shopcart_id (int): the id of the Shopcart of the Item
+        item (Item or int): the Item, or its id
+        removed (bool): whether the Item was removed from the Shopcart
+    """
+    db.session.info.setdefault("item_changes", []).append((shopcart_id, item, removed))
+
+
+# INSERT constructs that support ON CONFLICT, by database dialect
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# Statements that lock a customer until the end of the transaction, by
+# database dialect. SQLite runs one writer at a time, so it needs none.
+CUSTOMER_LOCKS = {
+    "postgresql": "SELECT pg_advisory_xact_lock(hashtext('shopcart'), :customer_id)"
+}
+
+
+def serialize_items(items):
+    """Serializes a list of Items"""
+    serialize_item = compile_serializer(Item)
+    return [serialize_item(item) for item in items]
+
+
+def search_shopcarts(shopcart_model, item_model, fields, filters):
+    """
+    Returns the carts of shopcart_model that match filters, as dicts
+
+    The carts come from one SELECT of the projected columns, and their items
+    from one more, grouped by cart in a single pass.
+    """
+    criteria = []
+    if filters.get("customer_id") is not None:
+        criteria.append(shopcart_model.customer_id == filters["customer_id"])
+    if filters.get("max_price") is not None:
+        criteria.append(shopcart_model.total_price <= filters["max_price"])
+    if filters.get("min_price") is not None:
+        criteria.append(shopcart_model.total_price >= filters["min_price"])
+    if filters.get("item_id") is not None:
+        criteria.append(
+            db.exists().where(
+                item_model.shopcart_id == shopcart_model.id,
+                item_model.id == filters["item_id"],
+            )
+        )
+    with_items = not fields or "items" in fields
+    # the id is needed to match the items to their cart, even if not returned
+    extra = ("id",) if with_items and fields and "id" not in fields else ()
+    shopcarts = shopcart_model.select_dicts(fields and fields + extra, criteria)
+    if not with_items:
+        return shopcarts
+
+    items = {}
+    selected = db.select(shopcart_model.id).where(*criteria)
+    for item in item_model.select_dicts(None, [item_model.shopcart_id.in_(selected)]):
+        items.setdefault(item["shopcart_id"], []).append(item)
+    for shopcart in shopcarts:
+        shopcart_id = shopcart.pop("id") if extra else shopcart["id"]
+        shopcart["items"] = items.get(shopcart_id, [])
+    return shopcarts
 
 
 class PersistentBase:
     """Base class added persistent methods"""
 
+    # Names of the fields that serialize() produces, in output order
+    serializable_fields = ()
+    # Functions that turn field values into their JSON representation
+    field_converters = {}
+
     def __init__(self):
         self.id = None  # pylint: disable=invalid-name
 
-    @abstractmethod
-    def serialize(self) -> dict:
-        """Convert an object into a dictionary"""
+    def serialize(self, fields=None) -> dict:
+        """
+        Convert an object into a dictionary
+
+        Args:
+            fields (tuple): the fields to include, all of them when None
+        """
+        # only the requested attributes are touched so that columns left out
+        # of the SELECT by load_only() are not lazy loaded here
+        return compile_serializer(type(self), fields)(self)
 
     @abstractmethod
     def deserialize(self, data: dict) -> None:
@@ -55,22 +145,89 @@ class PersistentBase:
         """Initializes the database session"""
         logger.info("Initializing database")
         cls.app = app
-        # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
+        # This is where we initialize SQLAlchemy from the Flask app, unless
+        # an earlier call already did (Flask refuses it after a request)
+        if "sqlalchemy" not in app.extensions:
+            db.init_app(app)
+            app.teardown_request(remove_session)
         app.app_context().push()
         db.create_all()  # make our sqlalchemy tables
+        if app.config.get("UNIQUE_LINE_ITEMS"):
+            Item.unique_name_index().create(db.engine, checkfirst=True)
+
+    @classmethod
+    def check_fields(cls, fields):
+        """
+        Validates a projection of the serializable fields
+
+        Args:
+            fields (list): names of the fields to keep, or None for all of them
+
+        Returns:
+            tuple: the validated field names, once each and in the order of
+            serializable_fields, or None for all of them
+        """
+        if not fields:
+            return None
+        unknown = [name for name in fields if name not in cls.serializable_fields]
+        if unknown:
+            raise DataValidationError(
+                f"Invalid {cls.__name__} field(s): {', '.join(unknown)}"
+            )
+        # the same projection always makes the same key of the serializer caches
+        return tuple(name for name in cls.serializable_fields if name in fields)
 
     @classmethod
-    def all(cls):
+    def load_options(cls, fields):
+        """Returns the loader options that restrict a SELECT to the given fields"""
+        # related rows are loaded for all the records in one more query, not one
+        # query per record
+        options = [
+            selectinload(getattr(cls, name))
+            for name in fields or cls.serializable_fields
+            if name in cls.__mapper__.relationships
+        ]
+        if not fields:
+            return options
+        columns = [getattr(cls, name) for name in fields if name in cls.__table__.c]
+        # the primary key is always loaded, so it keeps load_only() from being empty
+        return [load_only(cls.id, *columns)] + options
+
+    @classmethod
+    def select_dicts(cls, fields=None, criteria=()):
+        """
+        Returns the records that match criteria as dicts, without ORM objects
+
+        Only the columns of the projection are selected, in id order, and the
+        rows go straight into dicts of the documented API schema.
+
+        Args:
+            fields (tuple): the fields to return, all of the columns when None
+            criteria (list): SQL expressions that the records must match
+        """
+        names = tuple(
+            name
+            for name in fields or cls.serializable_fields
+            if name in cls.__table__.c
+        )
+        rows = db.session.execute(
+            db.select(*(cls.__table__.c[name] for name in names))
+            .where(*criteria)
+            .order_by(cls.id)
+        )
+        return list(map(compile_row_serializer(cls, names), rows))
+
+    @classmethod
+    def all(cls, fields=None):
         """Returns all of the records in the database"""
         logger.info("Processing all records")
-        return cls.query.all()
+        return cls.query.options(*cls.load_options(fields)).all()
 
     @classmethod
-    def find(cls, by_id):
+    def find(cls, by_id, fields=None):
         """Finds a record by it's ID"""
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.get(by_id)
+        return db.session.get(cls, by_id, options=cls.load_options(fields))
 
 
 class Shopcart(db.Model, PersistentBase):
@@ -79,31 +236,55 @@ class Shopcart(db.Model, PersistentBase):
     """
 
     __tablename__ = "shopcart"
+    # never reuse the id of a cart that was deleted or archived
+    __table_args__ = {"sqlite_autoincrement": True}
+    serializable_fields = (
+        "id",
+        "customer_id",
+        "creation_time",
+        "last_updated_time",
+        "items",
+        "total_price",
+        "version",
+    )
+    field_converters = {
+        "creation_time": datetime.isoformat,
+        "last_updated_time": datetime.isoformat,
+        "items": serialize_items,
+        # money is a Decimal in the service and a number in JSON
+        "total_price": float,
+    }
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer)
-    creation_time = db.Column(db.DateTime(), nullable=False, default=datetime.now())
-    last_updated_time = db.Column(db.DateTime(), nullable=False, default=datetime.now())
+    customer_id = db.Column(db.Integer, index=True)
+    creation_time = db.Column(
+        db.DateTime(), nullable=False, default=datetime.now(), index=True
+    )
+    last_updated_time = db.Column(
+        db.DateTime(), nullable=False, default=datetime.now(), index=True
+    )
     items = db.relationship("Item", backref="shopcart", passive_deletes=True)
-    total_price = db.Column(db.Float(4))
+    total_price = db.Column(db.Numeric(14, 4))
+    # bumped by the change log at each commit that changes the Items
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     def __repr__(self):
         return f"<ShopCart from {self.customer_id} id=[{self.id}]>"
 
-    def serialize(self):
-        """Serializes a Shopping Cart into a dictionary"""
-        shopcart = {
-            "id": self.id,
-            "customer_id": self.customer_id,
-            "creation_time": self.creation_time.isoformat(),
-            "last_updated_time": self.last_updated_time.isoformat(),
-            "items": [],
-            "total_price": self.total_price,
-        }
-
-        for item in self.items:
-            shopcart["items"].append(item.serialize())
+    @classmethod
+    def all(cls, fields=None, include_archived=False):
+        """Returns all of the Shopcarts, with the archived ones when asked"""
+        shopcarts = super().all(fields)
+        if include_archived:
+            shopcarts += ShopcartArchive.all(fields)
+        return shopcarts
 
+    @classmethod
+    def find(cls, by_id, fields=None, include_archived=False):
+        """Finds a Shopcart by it's ID, looking in the archive when asked"""
+        shopcart = super().find(by_id, fields)
+        if shopcart is None and include_archived:
+            shopcart = ShopcartArchive.find(by_id, fields)
         return shopcart
 
     def deserialize(self, data):
@@ -138,13 +319,44 @@ class Shopcart(db.Model, PersistentBase):
             ) from error
         return self
 
-    def get_total_price(self) -> float:
+    def get_total_price(self) -> Decimal:
         """It can calculate the total price of the shopcart"""
-        total = float(0.0)
-        for item in self.items:
-            total += float(item.price) * float(item.quantity)
+        return sum(
+            (to_money(item.price) * item.quantity for item in self.items),
+            Decimal(0),
+        )
+
+    @classmethod
+    def total_price_sql(cls):
+        """
+        Returns the SQL SUM of price * quantity over the Items of a Shopcart
+
+        It is correlated to the shopcart row of the enclosing statement, so
+        UPDATE shopcart SET total_price = <it> recomputes each cart in SQL.
+        """
+        return (
+            db.select(db.func.coalesce(db.func.sum(Item.price * Item.quantity), 0))
+            .where(Item.shopcart_id == cls.id)
+            .scalar_subquery()
+        )
+
+    @classmethod
+    def refresh_totals(cls, ids):
+        """
+        Recomputes the total_price of the Shopcarts with the given ids in SQL
 
-        return total
+        Returns:
+            int: the number of Shopcarts updated
+        """
+        logger.info("Recomputing the totals of %d shopcarts", len(ids))
+        result = db.session.execute(
+            db.update(cls)
+            .where(cls.id.in_(ids))
+            .values(total_price=cls.total_price_sql()),
+            execution_options={"synchronize_session": "fetch"},
+        )
+        db.session.commit()
+        return result.rowcount
 
     def create(self):
         """
@@ -162,6 +374,252 @@ class Shopcart(db.Model, PersistentBase):
         db.session.add(self)
         db.session.commit()
 
+    @classmethod
+    def search(cls, fields=None, include_archived=False, **filters):
+        """
+        Returns the Shopcarts that match the filters as dicts of their fields
+
+        This is the read path of the list endpoint. The filters run in SQL,
+        only the projected columns are read, and no ORM objects are built.
+
+        Args:
+            fields (tuple): the fields to return, all of them when None
+            include_archived (bool): also search the archived Shopcarts
+            filters: customer_id, max_price, min_price and item_id
+        """
+        logger.info("Processing search for shopcarts %s", filters)
+        shopcarts = search_shopcarts(cls, Item, fields, filters)
+        if include_archived:
+            shopcarts += ShopcartArchive.search(fields, **filters)
+        return shopcarts
+
+    @classmethod
+    def find_many(cls, ids, fields=None):
+        """
+        Finds the Shopcarts with the given ids
+
+        The carts come from one SELECT ... WHERE id IN (...), and their Items
+        from one more, however many ids are asked for.
+
+        Returns:
+            list: the Shopcarts found, in no particular order
+        """
+        logger.info("Processing lookup for %d ids ...", len(ids))
+        return (
+            cls.query.options(*cls.load_options(fields)).filter(cls.id.in_(ids)).all()
+        )
+
+    @classmethod
+    def find_by_customer(cls, customer_id, fields=None):
+        """Returns the newest Shopcart of a customer, through the customer_id index"""
+        logger.info("Processing lookup for customer %s ...", customer_id)
+        return (
+            cls.query.options(*cls.load_options(fields))
+            .filter(cls.customer_id == customer_id)
+            .order_by(cls.id.desc())
+            .first()
+        )
+
+    @classmethod
+    def find_or_create_by_customer(cls, customer_id, fields=None):
+        """
+        Returns the Shopcart of a customer, creating an empty one if needed
+
+        When the customer has no cart, the customer is locked for the
+        transaction and the cart is created with an INSERT ... SELECT ...
+        WHERE NOT EXISTS ... RETURNING, so two concurrent calls never create
+        two carts. The call that loses the race reads the cart of the winner
+        with one SELECT.
+
+        Returns:
+            tuple: the Shopcart, and whether it was created
+        """
+        shopcart = cls.find_by_customer(customer_id, fields)
+        if shopcart:
+            return shopcart, False
+        lock = CUSTOMER_LOCKS.get(db.engine.dialect.name)
+        if lock:
+            db.session.execute(db.text(lock), {"customer_id": customer_id})
+        now = db.literal(datetime.now(), db.DateTime())
+        shopcart = db.session.scalar(
+            db.insert(cls)
+            .from_select(
+                ("customer_id", "creation_time", "last_updated_time", "total_price"),
+                db.select(db.literal(customer_id), now, now, db.literal(0)).where(
+                    ~db.exists().where(cls.customer_id == customer_id)
+                ),
+            )
+            .returning(cls)
+        )
+        db.session.commit()
+        if shopcart is None:
+            return cls.find_by_customer(customer_id, fields), False
+        logger.info("Created shopcart %s for customer %s", shopcart.id, customer_id)
+        return shopcart, True
+
+    def merge(self, source):
+        """
+        Merges the Items of another Shopcart into this one and deletes it
+
+        Items are matched by name. The quantities of the source Items are
+        added to the first matching Item of this cart, the other Items move
+        over, and the total is recomputed once. The whole merge is a fixed
+        number of set based statements in one transaction, whatever the size
+        of the carts.
+
+        Args:
+            source (Shopcart): the cart to merge in, usually a guest's
+        """
+        logger.info("Merging shopcart %s into %s", source.id, self.id)
+        incoming = db.aliased(Item)
+        kept = db.aliased(Item)
+        same_name = db.and_(
+            incoming.shopcart_id == source.id, incoming.name == Item.name
+        )
+        first_with_name = (
+            db.select(db.func.min(kept.id))
+            .where(kept.shopcart_id == self.id, kept.name == Item.name)
+            .scalar_subquery()
+        )
+        added_quantity = (
+            db.select(db.func.sum(incoming.quantity)).where(same_name).scalar_subquery()
+        )
+        # the session learns the changed and deleted rows from RETURNING
+        options = {"synchronize_session": "fetch"}
+        db.session.execute(
+            db.update(Item)
+            .where(
+                Item.shopcart_id == self.id,
+                Item.id == first_with_name,
+                db.exists().where(same_name),
+            )
+            .values(quantity=db.func.coalesce(Item.quantity, 0) + added_quantity),
+            execution_options=options,
+        )
+        # the names are read once up front, so duplicates in the source all move
+        names = db.select(kept.name).where(
+            kept.shopcart_id == self.id, kept.name.is_not(None)
+        )
+        db.session.execute(
+            db.update(Item)
+            .where(
+                Item.shopcart_id == source.id,
+                db.or_(Item.name.is_(None), Item.name.not_in(names)),
+            )
+            .values(shopcart_id=self.id),
+            execution_options=options,
+        )
+        db.session.execute(
+            db.delete(Item).where(Item.shopcart_id == source.id),
+            execution_options=options,
+        )
+        db.session.execute(
+            db.delete(Shopcart).where(Shopcart.id == source.id),
+            execution_options=options,
+        )
+        db.session.execute(
+            db.update(Shopcart)
+            .where(Shopcart.id == self.id)
+            .values(
+                total_price=Shopcart.total_price_sql(),
+                last_updated_time=datetime.now(),
+            ),
+            execution_options=options,
+        )
+        # any Item of the cart may have changed or moved in
+        item_ids = db.session.scalars(
+            db.select(Item.id).where(Item.shopcart_id == self.id)
+        ).all()
+        for item_id in item_ids:
+            note_item_change(self.id, item_id)
+        db.session.commit()
+        # the cart was changed behind the session's back, so read it again
+        db.session.execute(
+            db.select(Shopcart)
+            .where(Shopcart.id == self.id)
+            .options(joinedload(Shopcart.items))
+            .execution_options(populate_existing=True)
+        ).unique().all()
+
+    @classmethod
+    def delete_stale(cls, cutoff, limit):
+        """
+        Deletes one batch of Shopcarts that were last updated before cutoff
+
+        The batch is picked oldest first through the last_updated_time index
+        and runs in its own short transaction. Carts locked by another
+        transaction are skipped instead of waited on.
+
+        Args:
+            cutoff (datetime): carts updated before this time are deleted
+            limit (int): the most carts to delete in this batch
+
+        Returns:
+            int: the number of Shopcarts deleted
+        """
+        ids = db.session.scalars(
+            db.select(cls.id)
+            .where(cls.last_updated_time < cutoff)
+            .order_by(cls.last_updated_time)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if ids:
+            logger.info("Deleting %d stale shopcarts", len(ids))
+            db.session.execute(db.delete(Item).where(Item.shopcart_id.in_(ids)))
+            db.session.execute(db.delete(cls).where(cls.id.in_(ids)))
+        db.session.commit()
+        return len(ids)
+
+    @classmethod
+    def archive_old(cls, cutoff, limit):
+        """
+        Moves one batch of Shopcarts created before cutoff to the archive
+
+        The carts and their items are copied into the archive tables and
+        removed from the hot ones in the same short transaction. Carts locked
+        by another transaction are skipped instead of waited on.
+
+        Args:
+            cutoff (datetime): carts created before this time are archived
+            limit (int): the most carts to archive in this batch
+
+        Returns:
+            int: the number of Shopcarts archived
+        """
+        ids = db.session.scalars(
+            db.select(cls.id)
+            .where(cls.creation_time < cutoff)
+            .order_by(cls.creation_time)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if ids:
+            logger.info("Archiving %d shopcarts", len(ids))
+            archived_time = db.literal(datetime.now(), db.DateTime())
+            columns = ShopcartArchive.copied_columns
+            db.session.execute(
+                db.insert(ShopcartArchive).from_select(
+                    columns + ("archived_time",),
+                    db.select(
+                        *(getattr(cls, name) for name in columns), archived_time
+                    ).where(cls.id.in_(ids)),
+                )
+            )
+            columns = ItemArchive.copied_columns
+            db.session.execute(
+                db.insert(ItemArchive).from_select(
+                    columns,
+                    db.select(*(getattr(Item, name) for name in columns)).where(
+                        Item.shopcart_id.in_(ids)
+                    ),
+                )
+            )
+            db.session.execute(db.delete(Item).where(Item.shopcart_id.in_(ids)))
+            db.session.execute(db.delete(cls).where(cls.id.in_(ids)))
+        db.session.commit()
+        return len(ids)
+
 
 ######################################################################
 #  I T E M   M O D E L
@@ -172,30 +630,31 @@ class Item(db.Model, PersistentBase):
     """
 
     __tablename__ = "item"
+    serializable_fields = (
+        "id",
+        "shopcart_id",
+        "name",
+        "price",
+        "description",
+        "quantity",
+    )
+    field_converters = {"price": float}
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
     shopcart_id = db.Column(
-        db.Integer, db.ForeignKey("shopcart.id", ondelete="CASCADE"), nullable=False
+        db.Integer,
+        db.ForeignKey("shopcart.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     name = db.Column(db.String(64))
-    price = db.Column(db.Float(4))
+    price = db.Column(db.Numeric(14, 4))
     description = db.Column(db.String(128))
     quantity = db.Column(db.Integer)
 
     def __repr__(self):
         return f"<Item {self.name} id=[{self.id}] shopcart[{self.shopcart_id}]>"
 
-    def serialize(self) -> dict:
-        """Converts an Item into a dictionary"""
-        return {
-            "id": self.id,
-            "shopcart_id": self.shopcart_id,
-            "name": self.name,
-            "price": self.price,
-            "description": self.description,
-            "quantity": self.quantity,
-        }
-
     def deserialize(self, data: dict) -> None:
         """
         Populates an Item from a dictionary
@@ -206,7 +665,7 @@ class Item(db.Model, PersistentBase):
         try:
             self.shopcart_id = data["shopcart_id"]
             self.name = data["name"]
-            self.price = data["price"]
+            self.price = to_money(data["price"])
             self.description = data["description"]
             self.quantity = data["quantity"]
         except KeyError as error:
@@ -229,3 +688,302 @@ class Item(db.Model, PersistentBase):
         self.id = None
         db.session.add(self)
         db.session.commit()
+
+    @classmethod
+    def unique_name_index(cls):
+        """
+        Returns the unique index on (shopcart_id, name) that add() relies on
+
+        It is not part of the table definition, so that it is only created
+        when the UNIQUE_LINE_ITEMS setting turns it on.
+        """
+        for index in cls.__table__.indexes:
+            if index.name == "ix_item_shopcart_id_name":
+                return index
+        return db.Index(
+            "ix_item_shopcart_id_name", cls.shopcart_id, cls.name, unique=True
+        )
+
+    @classmethod
+    def add(cls, shopcart_id, data):
+        """
+        Adds an Item to a Shopcart, or adds to the line that has its name
+
+        The cart row is touched first, which also locks it, the Item is
+        upserted with INSERT ... ON CONFLICT DO UPDATE, and the total is then
+        recomputed in SQL, so adding to a cart is three statements and a
+        commit with no read-modify-write. A line that already has the name
+        keeps its price, and the total follows it. It needs the
+        unique_name_index() to exist.
+
+        Args:
+            shopcart_id (int): the id of the Shopcart to add to
+            data (dict): A dictionary containing the Item data
+
+        Returns:
+            Item: the added or incremented Item, or None if there is no such
+            Shopcart
+        """
+        item = cls().deserialize(data)
+        logger.info("Adding %s to shopcart %s ...", item.name, shopcart_id)
+        options = {"synchronize_session": "fetch"}
+        added = db.session.execute(
+            db.update(Shopcart)
+            .where(Shopcart.id == shopcart_id)
+            .values(last_updated_time=datetime.now()),
+            execution_options=options,
+        )
+        if not added.rowcount:
+            db.session.rollback()
+            return None
+        insert = UPSERT_INSERTS[db.engine.dialect.name](cls).values(
+            shopcart_id=shopcart_id,
+            name=item.name,
+            price=item.price,
+            description=item.description,
+            quantity=item.quantity,
+        )
+        upsert = insert.on_conflict_do_update(
+            index_elements=[cls.shopcart_id, cls.name],
+            set_={"quantity": cls.quantity + insert.excluded.quantity},
+        ).returning(cls)
+        # an Item already in the session takes the quantity that was returned
+        item = db.session.scalars(
+            db.select(cls)
+            .from_statement(upsert)
+            .execution_options(populate_existing=True)
+        ).one()
+        note_item_change(shopcart_id, item)
+        db.session.execute(
+            db.update(Shopcart)
+            .where(Shopcart.id == shopcart_id)
+            .values(total_price=Shopcart.total_price_sql()),
+            execution_options=options,
+        )
+        db.session.commit()
+        return item
+
+    @staticmethod
+    def parse_quantity_change(change):
+        """
+        Parses a quantity change such as "+1", "-2" or 3
+
+        Returns:
+            tuple: the number, and whether it is added to the quantity
+        """
+        relative = isinstance(change, str) and change.strip()[:1] in ("+", "-")
+        try:
+            # int() would turn True into 1 and truncate 2.7 to 2
+            if isinstance(change, bool) or (
+                isinstance(change, float) and not change.is_integer()
+            ):
+                raise ValueError(change)
+            number = int(change)
+        except (TypeError, ValueError) as error:
+            raise DataValidationError(
+                f"Invalid quantity: {change!r}, expected a number like 3, +1 or -1"
+            ) from error
+        if number < 0 and not relative:
+            raise DataValidationError(f"Invalid quantity: {change!r} is negative")
+        return number, relative
+
+    @classmethod
+    def change_quantity(cls, shopcart_id, item_id, change):
+        """
+        Sets or adds to the quantity of an Item and adjusts the cart total
+
+        The Item is changed by a single UPDATE ... RETURNING, and the total
+        of its cart by a second UPDATE in the same transaction, so there is
+        no read-modify-write race between concurrent changes.
+
+        Args:
+            shopcart_id (int): the id of the Shopcart of the Item
+            item_id (int): the id of the Item
+            change (str or int): "+1" or "-1" to add to the quantity, or the
+                new quantity
+
+        Returns:
+            Item: the changed Item, or None if there is no such Item
+        """
+        number, relative = cls.parse_quantity_change(change)
+        logger.info("Changing quantity of item %s by %s", item_id, change)
+        quantity = db.func.coalesce(cls.quantity, 0)
+        update = db.update(cls).where(cls.id == item_id, cls.shopcart_id == shopcart_id)
+        if relative:
+            update = update.where(quantity + number >= 0).values(
+                quantity=quantity + number
+            )
+        else:
+            update = update.values(quantity=number)
+        item = db.session.scalars(
+            update.returning(cls), execution_options={"populate_existing": True}
+        ).one_or_none()
+        if item is None:
+            db.session.rollback()
+            existing = cls.find(item_id, ("shopcart_id",))
+            if relative and existing and existing.shopcart_id == shopcart_id:
+                raise DataValidationError(
+                    f"Invalid quantity: {change!r} would make it negative"
+                )
+            return None
+        note_item_change(shopcart_id, item)
+        db.session.execute(
+            db.update(Shopcart)
+            .where(Shopcart.id == shopcart_id)
+            .values(
+                total_price=Shopcart.total_price_sql(),
+                last_updated_time=datetime.now(),
+            ),
+            execution_options={"synchronize_session": "fetch"},
+        )
+        db.session.commit()
+        return item
+
+    @classmethod
+    def reprice(cls, prices):
+        """
+        Sets new prices on Items by name and refreshes the totals of their carts
+
+        The Items are repriced with one UPDATE ... CASE, and the carts that
+        hold them with one UPDATE ... FROM (SELECT shopcart_id, SUM(...)
+        GROUP BY shopcart_id), in one transaction.
+
+        Args:
+            prices (dict): the new price of each Item name
+
+        Returns:
+            int: the number of Items repriced
+        """
+        logger.info("Repricing %d item names", len(prices))
+        options = {"synchronize_session": "fetch"}
+        repriced = db.session.execute(
+            db.update(cls)
+            .where(cls.name.in_(prices))
+            .values(price=db.case(prices, value=cls.name))
+            .returning(cls.id, cls.shopcart_id),
+            execution_options=options,
+        ).all()
+        for item_id, shopcart_id in repriced:
+            note_item_change(shopcart_id, item_id)
+        if repriced:
+            totals = (
+                db.select(
+                    cls.shopcart_id,
+                    db.func.sum(cls.price * cls.quantity).label("total_price"),
+                )
+                .where(cls.shopcart_id.in_({row.shopcart_id for row in repriced}))
+                .group_by(cls.shopcart_id)
+                .subquery()
+            )
+            db.session.execute(
+                db.update(Shopcart)
+                .where(Shopcart.id == totals.c.shopcart_id)
+                .values(total_price=totals.c.total_price),
+                execution_options=options,
+            )
+        db.session.commit()
+        return len(repriced)
+
+    @classmethod
+    def search(cls, shopcart_id, fields=None, price=None, name=None):
+        """
+        Returns the Items of a Shopcart as dicts of their fields
+
+        The price and name filters run in SQL and no ORM objects are built.
+
+        Args:
+            shopcart_id (int): the id of the Shopcart
+            fields (tuple): the fields to return, all of them when None
+            price (Decimal): only Items with this price
+            name (str): only Items with this in their name, in any case
+        """
+        logger.info("Processing items search for shopcart %s ...", shopcart_id)
+        criteria = [cls.shopcart_id == shopcart_id]
+        if price is not None:
+            criteria.append(cls.price == price)
+        if name is not None:
+            criteria.append(
+                db.func.lower(cls.name).contains(name.lower(), autoescape=True)
+            )
+        return cls.select_dicts(fields, criteria)
+
+    @classmethod
+    def find_by_shopcart(cls, shopcart_id, fields=None):
+        """Returns all of the Items in the Shopcart with the given id"""
+        logger.info("Processing items lookup for shopcart %s ...", shopcart_id)
+        return (
+            cls.query.options(*cls.load_options(fields))
+            .filter(cls.shopcart_id == shopcart_id)
+            .all()
+        )
+
+
+######################################################################
+#  A R C H I V E   M O D E L S
+######################################################################
+class ShopcartArchive(db.Model, PersistentBase):
+    """
+    Class that represents an archived Shopping Cart
+
+    Old carts are moved here by Shopcart.archive_old() to keep the hot
+    shopcart table and its indexes small. Archived carts are read only.
+    """
+
+    __tablename__ = "shopcart_archive"
+    serializable_fields = Shopcart.serializable_fields
+    field_converters = Shopcart.field_converters
+    # Columns copied over from the shopcart table
+    copied_columns = tuple(f for f in Shopcart.serializable_fields if f != "items")
+    # Table Schema
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    customer_id = db.Column(db.Integer)
+    creation_time = db.Column(db.DateTime(), nullable=False, index=True)
+    last_updated_time = db.Column(db.DateTime(), nullable=False)
+    items = db.relationship("ItemArchive", passive_deletes=True)
+    total_price = db.Column(db.Numeric(14, 4))
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    archived_time = db.Column(db.DateTime(), nullable=False)
+
+    def __repr__(self):
+        return f"<ArchivedShopCart from {self.customer_id} id=[{self.id}]>"
+
+    def deserialize(self, data):
+        """Archived Shopping Carts can not be changed"""
+        raise DataValidationError("Archived Shopping Carts are read only")
+
+    @classmethod
+    def search(cls, fields=None, **filters):
+        """Returns the archived Shopcarts that match the filters as dicts"""
+        logger.info("Processing search for archived shopcarts %s", filters)
+        return search_shopcarts(cls, ItemArchive, fields, filters)
+
+
+class ItemArchive(db.Model, PersistentBase):
+    """
+    Class that represents an Item of an archived Shopping Cart
+    """
+
+    __tablename__ = "item_archive"
+    serializable_fields = Item.serializable_fields
+    field_converters = Item.field_converters
+    # Columns copied over from the item table
+    copied_columns = Item.serializable_fields
+    # Table Schema
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    shopcart_id = db.Column(
+        db.Integer,
+        db.ForeignKey("shopcart_archive.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    name = db.Column(db.String(64))
+    price = db.Column(db.Numeric(14, 4))
+    description = db.Column(db.String(128))
+    quantity = db.Column(db.Integer)
+
+    def __repr__(self):
+        return f"<ArchivedItem {self.name} id=[{self.id}] shopcart[{self.shopcart_id}]>"
+
+    def deserialize(self, data):
+        """Items of archived Shopping Carts can not be changed"""
+        raise DataValidationError("Archived Items are read only")
@@ -8,26 +8,49 @@ POST /shopcarts - creates a new Shopcart record in the database
 PUT /shopcarts/{id} - updates a Shopcart record in the database
 DELETE /shopcarts/{id} - deletes a Shopcart record in the database
 GET /shopcarts - returns a list of Shopcarts from the database
+POST /shopcarts:batchGet - returns the Shopcarts with the given ids
+POST /shopcarts/{id}/merge - merges another Shopcart into a Shopcart
+GET /customers/{id}/shopcart - returns the Shopcart of a customer
+POST /customers/{id}/shopcart - returns the Shopcart of a customer, creating it
 DELETE /shopcarts/{id}/items - empties a Shopcart
 GET /shopcarts/{id}/items - returns a list of Items from the database
 GET /shopcarts/{id}/items/{id} - returns a list of Items from the database
 POST /shopcarts/{id}/items - creates a new Item record in the database
 PUT /shopcarts/{id}/items/{id} - updates a Item record in the database
+PATCH /shopcarts/{id}/items/{id} - sets or adds to the quantity of an Item
 DELETE /shopcarts/{id}/items/{id} - deletes a Item record in the database
 GET /shopcarts/{id}/items/{id} - returns a list of Items from the database
-"""
+GET /livez - answers while the worker is alive
+GET /readyz - answers 503 while the worker should get no traffic
 
-from flask import jsonify, request, abort, make_response
+The routes that sync a Shopcart to its clients are in service.sync_routes
+"""
+from flask import request, abort
 from flask_restx import Resource, fields, reqparse
 
 # from jinja2.exceptions import TemplateNotFound
-from service.common import status  # HTTP Status Codes
-from service.models import Shopcart, Item
+from service.common import shards, status  # HTTP Status Codes
+from service.common.admission import AdmissionController
+from service.common.events import note_event
+from service.common.idempotency import idempotent
+from service.common.readiness import ReadinessCheck, not_ready_reasons
+from service.common.single_flight import coalesce
+from service.models import (
+    db,
+    Shopcart,
+    ShopcartArchive,
+    Item,
+    note_item_change,
+    to_money,
+)
 
 
 # Import Flask application
 from . import app, api
 
+# The cached database check of /readyz
+readiness = ReadinessCheck()
+
 
 ######################################################################
 # GET INDEX
@@ -49,6 +72,29 @@ def health():
     return {"status": "OK"}, status.HTTP_200_OK
 
 
+@app.route("/livez")
+def livez():
+    """Liveness: the worker answers, without any I/O"""
+    return {"status": "OK"}, status.HTTP_200_OK
+
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: the database answers quickly and the worker is not overloaded"""
+    checks = dict(readiness.database(db.engine, app.config["READY_CHECK_SECONDS"]))
+    if isinstance(app.wsgi_app, AdmissionController):
+        checks["inflight"] = app.wsgi_app.inflight
+    reasons = not_ready_reasons(checks, app.config)
+    if reasons:
+        app.logger.warning("Not ready: %s", ", ".join(reasons))
+        return {
+            "status": "not ready",
+            "reasons": reasons,
+            "checks": checks,
+        }, status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "ready", "checks": checks}, status.HTTP_200_OK
+
+
 # Define the model so that the docs reflect what can be sent
 create_shopcarts_model = api.model(
     "Shopcarts",
@@ -105,6 +151,9 @@ shopcarts_model = api.inherit(
         "id": fields.Integer(
             readOnly=True, description="The unique id assigned internally by service"
         ),
+        "version": fields.Integer(
+            readOnly=True, description="The version of the Items of the shopcart"
+        ),
     },
 )
 
@@ -120,6 +169,38 @@ shopcarts_args.add_argument(
 shopcarts_args.add_argument(
     "date", type=str, location="args", required=False, help="List Shopcarts by date"
 )
+shopcarts_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated list of the fields to return",
+)
+shopcarts_args.add_argument(
+    "include_archived",
+    type=str,
+    location="args",
+    required=False,
+    help="Also list archived Shopcarts when set to true",
+)
+
+fields_args = reqparse.RequestParser()
+fields_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated list of the fields to return",
+)
+
+shopcart_args = fields_args.copy()
+shopcart_args.add_argument(
+    "include_archived",
+    type=str,
+    location="args",
+    required=False,
+    help="Also look for the Shopcart in the archive when set to true",
+)
 
 
 ######################################################################
@@ -139,6 +220,52 @@ def check_content_type(media_type):
     )
 
 
+def get_fields(model):
+    """Returns the projection asked for in the fields query parameter"""
+    names = request.args.get("fields")
+    if not names:
+        return None
+    return model.check_fields(
+        [name.strip() for name in names.split(",") if name.strip()]
+    )
+
+
+def get_include_archived():
+    """Checks if the include_archived query parameter asks for the archive"""
+    return request.args.get("include_archived", "").lower() == "true"
+
+
+def get_shopcart_filters():
+    """Returns the filters of the Shopcart list from the query string"""
+    customer_id = request.args.get("customer_id")
+    item_id = request.args.get("item")
+    max_price = request.args.get("maxprice")
+    min_price = request.args.get("minprice")
+    return {
+        "customer_id": int(customer_id) if customer_id else None,
+        "item_id": int(item_id) if item_id else None,
+        "max_price": to_money(max_price) if max_price else None,
+        "min_price": to_money(min_price) if min_price else None,
+    }
+
+
+def search_shards(model, projection, filters):
+    """
+    Searches the shards that can hold the Shopcarts that match filters
+
+    That is the shard of the customer_id filter, or else all of them in
+    parallel. The results are in the order of their ids.
+    """
+    if filters.get("customer_id") is not None:
+        shards.use_customer_shard(filters["customer_id"])
+        return model.search(projection, **filters)
+    return [
+        shopcart
+        for shopcarts in shards.fan_out(model.search, projection, **filters)
+        for shopcart in shopcarts
+    ]
+
+
 ######################################################################
 #  PATH: /shopcarts/{id}
 ######################################################################
@@ -159,6 +286,8 @@ class ShopcartsResource(Resource):
     # ------------------------------------------------------------------
     @api.doc("get_shopcarts")
     @api.response(404, "shopcart not found")
+    @api.expect(shopcart_args, validate=False)
+    @coalesce
     def get(self, shopcart_id):
         """
         Retrieve a single shopcart
@@ -166,23 +295,25 @@ class ShopcartsResource(Resource):
         This endpoint will return an shopcart based on it's id
         """
         app.logger.info("Request for shopcart with id: %s", shopcart_id)
-        shopcart = Shopcart.find(shopcart_id)
+        projection = get_fields(Shopcart)
+        shopcart = Shopcart.find(shopcart_id, projection, get_include_archived())
         if not shopcart:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id '{shopcart_id}' could not be found.",
             )
         app.logger.info("Returning shopcart_id: %s", shopcart.id)
-        return shopcart.serialize(), status.HTTP_200_OK
+        return shopcart.serialize(projection), status.HTTP_200_OK
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING shopcart
     # ------------------------------------------------------------------
     @api.doc("update_shopcart")
+    @api.response(409, "The customer_id belongs on another shard")
     @api.response(404, "shopcart not found")
     @api.response(400, "The posted shopcart data was not valid")
+    @api.response(200, "Success", shopcarts_model)
     @api.expect(shopcarts_model)
-    @api.marshal_with(shopcarts_model)
     def put(self, shopcart_id):
         """
         Update an Shopcart
@@ -203,7 +334,15 @@ class ShopcartsResource(Resource):
             )
 
         shopcart.deserialize(api.payload)
+        if not shards.owns_customer(shopcart_id, shopcart.customer_id):
+            abort(
+                status.HTTP_409_CONFLICT,
+                "customer_id can not move a Shopcart to another shard.",
+            )
         shopcart.id = shopcart_id
+        for item in api.payload.get("items") or ():
+            note_item_change(shopcart_id, item["id"])
+        note_event(db.session, shopcart_id, "updated", shopcart.version)
         shopcart.update()
         app.logger.info("Shopcart with ID [%s] updated.", shopcart.id)
 
@@ -223,8 +362,10 @@ class ShopcartsResource(Resource):
             "Request to delete an shopcart with shopcart ID %s", shopcart_id
         )
 
-        shopcart = Shopcart.find(shopcart_id)
+        # only the id, so the database cascades the delete to the Items
+        shopcart = Shopcart.find(shopcart_id, ("id",))
         if shopcart:
+            note_event(db.session, shopcart_id, "deleted")
             shopcart.delete()
             app.logger.info("shopcart with id [%s] was deleted", shopcart_id)
 
@@ -244,42 +385,15 @@ class ShopcartsCollection(Resource):
     @api.doc("list_shopcarts")
     @api.expect(shopcarts_args, validate=False)
     # @api.marshal_list_with(shopcarts_model)
+    @coalesce
     def get(self):
         """Return all the shopcarts"""
         app.logger.info("Request for shopcarts list")
-        shopcarts = []
-        shopcarts = Shopcart.all()
-        if not shopcarts:
-            return make_response(jsonify([]), status.HTTP_200_OK)
-        results = [shopcart.serialize() for shopcart in shopcarts]
-        customer_id = request.args.get("customer_id")
-        item_id = request.args.get("item")
-        max_price = request.args.get("maxprice")
-        min_price = request.args.get("minprice")
-        if customer_id:
-            results = [
-                cart for cart in results if cart["customer_id"] == int(customer_id)
-            ]
-        if max_price:
-            results = [
-                cart
-                for cart in results
-                if cart["total_price"] <= round(float(max_price), 2)
-            ]
-        if min_price:
-            results = [
-                cart
-                for cart in results
-                if cart["total_price"] >= round(float(min_price), 2)
-            ]
-        if item_id:
-            temp = []
-            for cart in results:
-                for item in cart["items"]:
-                    if item["id"] == int(item_id):
-                        temp.append(cart)
-                        break
-            results = temp
+        projection = get_fields(Shopcart)
+        filters = get_shopcart_filters()
+        results = search_shards(Shopcart, projection, filters)
+        if get_include_archived():
+            results += search_shards(ShopcartArchive, projection, filters)
         return results, status.HTTP_200_OK
 
     # ------------------------------------------------------------------
@@ -287,8 +401,9 @@ class ShopcartsCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc("create_shopcarts")
     @api.response(400, "The posted data was not valid")
+    @api.response(201, "Created", shopcarts_model)
     @api.expect(create_shopcarts_model)
-    @api.marshal_with(shopcarts_model, code=201)
+    @idempotent
     def post(self):
         """
         Creates an shopcart
@@ -298,6 +413,7 @@ class ShopcartsCollection(Resource):
         check_content_type("application/json")
         shopcart = Shopcart()
         shopcart.deserialize(api.payload)
+        shards.use_customer_shard(shopcart.customer_id)
         shopcart.create()
         message = shopcart.serialize()
         location_url = api.url_for(
@@ -308,6 +424,210 @@ class ShopcartsCollection(Resource):
         return message, status.HTTP_201_CREATED, {"Location": location_url}
 
 
+batch_get_model = api.model(
+    "BatchGet",
+    {
+        "ids": fields.List(
+            fields.Integer, required=True, description="The Shopcart ids to get"
+        ),
+    },
+)
+
+batch_get_result_model = api.model(
+    "BatchGetResult",
+    {
+        "shopcarts": fields.List(
+            fields.Nested(shopcarts_model), description="The Shopcarts found"
+        ),
+        "missing": fields.List(
+            fields.Integer, description="The ids that no Shopcart has"
+        ),
+    },
+)
+
+
+######################################################################
+#  PATH: /shopcarts:batchGet
+######################################################################
+@api.route("/shopcarts:batchGet")
+class ShopcartsBatchGet(Resource):
+    """Gets many Shopcarts in one request"""
+
+    @api.doc("batch_get_shopcarts")
+    @api.response(400, "The posted ids were not valid")
+    @api.response(200, "Success", batch_get_result_model)
+    @api.expect(batch_get_model, fields_args)
+    def post(self):
+        """
+        Retrieve many Shopcarts
+
+        This endpoint will return the Shopcarts with the ids that are posted,
+        in the order they were asked for, and the ids that were not found
+        """
+        app.logger.info("Request for a batch of shopcarts")
+        check_content_type("application/json")
+        data = request.get_json()
+        ids = data.get("ids") if isinstance(data, dict) else None
+        max_ids = app.config["BATCH_GET_MAX_IDS"]
+        if (
+            not isinstance(ids, list)
+            or not 0 < len(ids) <= max_ids
+            or not all(
+                isinstance(cart_id, int) and not isinstance(cart_id, bool)
+                for cart_id in ids
+            )
+        ):
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"ids must be a list of 1 to {max_ids} Shopcart ids",
+            )
+
+        projection = get_fields(Shopcart)
+        # the id is needed to put the carts in order, even if not returned
+        load_fields = projection and projection + ("id",)
+        found = {
+            cart.id: cart
+            for carts in shards.fan_out_ids(Shopcart.find_many, ids, load_fields)
+            for cart in carts
+        }
+        ids = list(dict.fromkeys(ids))
+        return {
+            "shopcarts": [
+                found[cart_id].serialize(projection)
+                for cart_id in ids
+                if cart_id in found
+            ],
+            "missing": [cart_id for cart_id in ids if cart_id not in found],
+        }, status.HTTP_200_OK
+
+
+merge_model = api.model(
+    "Merge",
+    {
+        "source_id": fields.Integer(
+            required=True, description="The id of the Shopcart to merge in"
+        ),
+    },
+)
+
+
+######################################################################
+#  PATH: /shopcarts/{id}/merge
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/merge")
+@api.param("shopcart_id", "The Shopcart identifier")
+class MergeResource(Resource):
+    """Merges another Shopcart, such as a guest's, into a Shopcart"""
+
+    @api.doc("merge_shopcarts")
+    @api.response(409, "The Shopcarts are on different shards")
+    @api.response(404, "shopcart not found")
+    @api.response(400, "The posted data was not valid")
+    @api.response(200, "Success", shopcarts_model)
+    @api.expect(merge_model)
+    def post(self, shopcart_id):
+        """
+        Merge a Shopcart into this one
+
+        This endpoint will add the items of the Shopcart with the source_id
+        that is posted to this Shopcart, and then delete that Shopcart
+        """
+        app.logger.info("Request to merge into shopcart with id: %s", shopcart_id)
+        check_content_type("application/json")
+        data = request.get_json()
+        source_id = data.get("source_id") if isinstance(data, dict) else None
+        if (
+            not isinstance(source_id, int)
+            or isinstance(source_id, bool)
+            or source_id == shopcart_id
+        ):
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "source_id must be the id of another Shopcart",
+            )
+
+        if not shards.same_shard(shopcart_id, source_id):
+            abort(
+                status.HTTP_409_CONFLICT,
+                "Shopcarts on different shards can not be merged.",
+            )
+
+        shopcart = Shopcart.find(shopcart_id)
+        source = Shopcart.find(source_id, ("id",))
+        for cart_id, cart in ((shopcart_id, shopcart), (source_id, source)):
+            if not cart:
+                abort(
+                    status.HTTP_404_NOT_FOUND,
+                    f"Shopcart with id '{cart_id}' could not be found.",
+                )
+
+        note_event(db.session, source_id, "deleted")
+        shopcart.merge(source)
+        app.logger.info("Shopcart [%s] merged into [%s].", source_id, shopcart_id)
+        return shopcart.serialize(), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /customers/{customer_id}/shopcart
+######################################################################
+@api.route("/customers/<int:customer_id>/shopcart")
+@api.param("customer_id", "The Customer identifier")
+class CustomerShopcartResource(Resource):
+    """
+    CustomerShopcartResource class
+
+    Looks up the Shopcart of a customer through the customer_id index
+    GET /customers/{id}/shopcart - Returns the Shopcart of the customer
+    POST /customers/{id}/shopcart - Returns it, creating an empty one if needed
+    """
+
+    @api.doc("get_customer_shopcart")
+    @api.response(404, "shopcart not found")
+    @api.response(200, "Success", shopcarts_model)
+    @api.expect(fields_args, validate=False)
+    @coalesce
+    def get(self, customer_id):
+        """
+        Retrieve the Shopcart of a customer
+
+        This endpoint will return the newest Shopcart of the customer
+        """
+        app.logger.info("Request for the shopcart of customer: %s", customer_id)
+        projection = get_fields(Shopcart)
+        shopcart = Shopcart.find_by_customer(customer_id, projection)
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart for customer '{customer_id}' could not be found.",
+            )
+        return shopcart.serialize(projection), status.HTTP_200_OK
+
+    @api.doc("get_or_create_customer_shopcart")
+    @api.response(200, "Success", shopcarts_model)
+    @api.response(201, "Created", shopcarts_model)
+    @api.expect(fields_args, validate=False)
+    def post(self, customer_id):
+        """
+        Retrieve the Shopcart of a customer, creating it if needed
+
+        This endpoint will return the newest Shopcart of the customer, or
+        create an empty one when the customer has none
+        """
+        app.logger.info("Request for the shopcart of customer: %s", customer_id)
+        projection = get_fields(Shopcart)
+        shopcart, created = Shopcart.find_or_create_by_customer(customer_id, projection)
+        if created:
+            location_url = api.url_for(
+                ShopcartsResource, shopcart_id=shopcart.id, _external=True
+            )
+            return (
+                shopcart.serialize(projection),
+                status.HTTP_201_CREATED,
+                {"Location": location_url},
+            )
+        return shopcart.serialize(projection), status.HTTP_200_OK
+
+
 create_items_model = api.model(
     "Items",
     {
@@ -336,6 +656,17 @@ items_model = api.inherit(
 )
 
 
+quantity_model = api.model(
+    "Quantity",
+    {
+        "quantity": fields.String(
+            required=True,
+            description='The new quantity, or a change of it like "+1" or "-1"',
+        ),
+    },
+)
+
+
 ######################################################################
 #  PATH: /shopcarts/<shopcart_id>/items/<item_id>
 ######################################################################
@@ -360,7 +691,9 @@ class ItemsResource(Resource):
     # ------------------------------------------------------------------
     @api.doc("read_item")
     @api.response(404, "Item not found")
-    @api.marshal_with(items_model)
+    @api.response(200, "Success", items_model)
+    @api.expect(fields_args, validate=False)
+    @coalesce
     def get(self, shopcart_id, item_id):
         """
         Get an Item
@@ -373,20 +706,21 @@ class ItemsResource(Resource):
 
         if not isinstance(item_id, int):
             raise TypeError("item_id should be int")
-        cart = Shopcart.find(shopcart_id)
+        projection = get_fields(Item)
+        cart = Shopcart.find(shopcart_id, ("id",))
         if not cart:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Cart with id '{shopcart_id}' was not found.",
             )
 
-        item = Item.find(item_id)
+        item = Item.find(item_id, projection)
         if not item:
             abort(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
 
-        app.logger.info("Returning item: %s", item.name)
+        app.logger.info("Returning item: %s", item.id)
 
-        return item.serialize(), status.HTTP_200_OK
+        return item.serialize(projection), status.HTTP_200_OK
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING ITEM
@@ -394,8 +728,8 @@ class ItemsResource(Resource):
     @api.doc("update_item")
     @api.response(404, "Item not found")
     @api.response(400, "The posted Item data was not valid")
+    @api.response(200, "Success", items_model)
     @api.expect(items_model)
-    @api.marshal_with(items_model)
     def put(self, shopcart_id, item_id):
         """
         Update a Item
@@ -422,6 +756,7 @@ class ItemsResource(Resource):
         item.deserialize(request.get_json())
 
         item.id = item_id
+        note_item_change(shopcart_id, item)
         item.update()
         cart.total_price = cart.get_total_price()
         cart.update()
@@ -429,6 +764,36 @@ class ItemsResource(Resource):
 
         return item.serialize(), status.HTTP_200_OK
 
+    # ------------------------------------------------------------------
+    # CHANGE THE QUANTITY OF AN ITEM
+    # ------------------------------------------------------------------
+    @api.doc("change_item_quantity")
+    @api.response(404, "Item not found")
+    @api.response(400, "The posted quantity was not valid")
+    @api.response(200, "Success", items_model)
+    @api.expect(quantity_model)
+    def patch(self, shopcart_id, item_id):
+        """
+        Change the quantity of an Item
+
+        This endpoint will add to the quantity of an Item when the posted
+        quantity is signed, like "+1" or "-1", and set it otherwise
+        """
+        app.logger.info("Request to change the quantity of item: %s", item_id)
+        check_content_type("application/json")
+        data = request.get_json()
+        if not isinstance(data, dict) or "quantity" not in data:
+            abort(status.HTTP_400_BAD_REQUEST, "Invalid Item: missing quantity")
+
+        item = Item.change_quantity(shopcart_id, item_id, data["quantity"])
+        if not item:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Item with id '{item_id}' was not found in cart '{shopcart_id}'.",
+            )
+        app.logger.info("Item with ID [%s] now has %s.", item_id, item.quantity)
+        return item.serialize(), status.HTTP_200_OK
+
     # ------------------------------------------------------------------
     # DELETE AN ITEM
     # ------------------------------------------------------------------
@@ -462,6 +827,7 @@ class ItemsResource(Resource):
 
         if item:
             shopcart.items.remove(item)
+            note_item_change(shopcart_id, item, removed=True)
             item.delete()
 
         shopcart.total_price = shopcart.get_total_price()
@@ -484,7 +850,9 @@ class ItemsCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc("list_items")
     @api.response(404, "shopcart not found")
-    @api.marshal_list_with(items_model)
+    @api.response(200, "Success", [items_model])
+    @api.expect(fields_args, validate=False)
+    @coalesce
     def get(self, shopcart_id):
         """
         Return all of the items in a Shopcart
@@ -499,7 +867,8 @@ class ItemsCollection(Resource):
             raise ValueError(
                 "shopcart_id must be an integer while list items of shopcart"
             )
-        shopcart = Shopcart.find(shopcart_id)
+        projection = get_fields(Item)
+        shopcart = Shopcart.find(shopcart_id, ("id",))
         if not shopcart:
             abort(
                 status.HTTP_404_NOT_FOUND,
@@ -508,25 +877,12 @@ class ItemsCollection(Resource):
 
         # Get filters from query parameters
         price_filter = request.args.get("price")
-        name_filter = request.args.get("name")
-
-        # Apply filters to the items
-        filtered_items = shopcart.items
-
-        if price_filter is not None:
-            filtered_items = [
-                item for item in filtered_items if item.price == float(price_filter)
-            ]
-
-        if name_filter is not None:
-            filtered_items = [
-                item
-                for item in filtered_items
-                if name_filter.lower() in item.name.lower()
-            ]
-
-        # Serialize the filtered items
-        results = [item.serialize() for item in filtered_items]
+        results = Item.search(
+            shopcart_id,
+            projection,
+            price=to_money(price_filter) if price_filter is not None else None,
+            name=request.args.get("name"),
+        )
 
         app.logger.info(
             "Returning filtered item list with shopcart_id: %s", shopcart.id
@@ -540,8 +896,9 @@ class ItemsCollection(Resource):
     @api.doc("add_item")
     @api.response(400, "The posted data was not valid")
     @api.response(404, "shopcart not found")
+    @api.response(201, "Created", items_model)
     @api.expect(create_items_model)
-    @api.marshal_with(items_model, code=201)
+    @idempotent
     def post(self, shopcart_id):
         """
         Creates a Item
@@ -550,6 +907,16 @@ class ItemsCollection(Resource):
         app.logger.info("Request to create an Item")
         check_content_type("application/json")
 
+        if app.config["UNIQUE_LINE_ITEMS"]:
+            # one upsert, that adds to the line of an Item with the same name
+            item = Item.add(shopcart_id, request.get_json())
+            if not item:
+                abort(
+                    status.HTTP_404_NOT_FOUND,
+                    f"Shopcart with id '{shopcart_id}' could not be found.",
+                )
+            return item.serialize(), status.HTTP_201_CREATED
+
         # See if the shopcart exists and abort if it doesn't
         shopcart = Shopcart.find(shopcart_id)
         if not shopcart:
@@ -563,6 +930,7 @@ class ItemsCollection(Resource):
         item.deserialize(request.get_json())
         # Append the item to the shopcart
         shopcart.items.append(item)
+        note_item_change(shopcart_id, item)
         shopcart.total_price = shopcart.get_total_price()
         shopcart.update()
 
@@ -580,8 +948,10 @@ class ItemsCollection(Resource):
         app.logger.info("Request for emptying shopcart with id : %s", shopcart_id)
         shopcart = Shopcart.find(shopcart_id)
         if shopcart:
+            # one commit for all of the Items, so the cart gets one new version
             for item in shopcart.items:
-                item.delete()
+                note_item_change(shopcart_id, item, removed=True)
+                db.session.delete(item)
         shopcart.total_price = 0
         shopcart.update()
         return "", status.HTTP_204_NO_CONTENT
@@ -0,0 +1,112 @@
+"""
+Shopcart Sync
+
+These routes let the clients of a Shopcart keep up with its changes, by
+asking for them or by following them as they happen
+
+GET /shopcarts/{id}/changes?since={version} - returns the Items changed since a version
+GET /shopcarts/{id}/events - streams the changes of a Shopcart as Server-Sent Events
+"""
+from flask import request, abort
+from werkzeug.exceptions import ServiceUnavailable
+from flask_restx import Resource, reqparse
+from service.common import status
+from service.common.change_log import changes_since
+from service.common.events import event_stream, get_bus
+from service.common.single_flight import coalesce
+from service.models import Shopcart
+
+# Import Flask application
+from . import app, api
+
+
+changes_args = reqparse.RequestParser()
+changes_args.add_argument(
+    "since",
+    type=int,
+    location="args",
+    required=True,
+    help="The version of the Shopcart that the client has",
+)
+
+
+######################################################################
+#  PATH: /shopcarts/{id}/changes
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/changes")
+@api.param("shopcart_id", "The Shopcart identifier")
+class ChangesResource(Resource):
+    """Returns the changes to the Items of a Shopcart since a version"""
+
+    @api.doc("list_changes")
+    @api.response(404, "shopcart not found")
+    @api.response(400, "The since version was not valid")
+    @api.expect(changes_args, validate=False)
+    @coalesce
+    def get(self, shopcart_id):
+        """
+        Return the changes to the Items of a Shopcart
+
+        This endpoint will return the Items added, updated and removed since
+        the version of the Shopcart in the since query parameter
+        """
+        app.logger.info("Request for the changes of shopcart %s", shopcart_id)
+        since = request.args.get("since", "")
+        if not since.isdigit():
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "since must be a version of the Shopcart, like 0 or 12",
+            )
+
+        shopcart = Shopcart.find(shopcart_id, ("id", "version"))
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id '{shopcart_id}' could not be found.",
+            )
+        return changes_since(shopcart, int(since)), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /shopcarts/{id}/events
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/events")
+@api.param("shopcart_id", "The Shopcart identifier")
+class EventsResource(Resource):
+    """Streams the changes of a Shopcart as Server-Sent Events"""
+
+    @api.doc("stream_events")
+    @api.response(503, "The worker streams to as many clients as it can")
+    @api.response(404, "shopcart not found")
+    @api.response(200, "A text/event-stream of the changes")
+    @api.produces(["text/event-stream"])
+    def get(self, shopcart_id):
+        """
+        Follow the changes of a Shopcart
+
+        This endpoint will send a changed event with the new version of the
+        Shopcart each time its Items change, until the stream ends or the
+        Shopcart is deleted. A client behind the current version, as told by
+        Last-Event-ID or the since query parameter, gets a changed event
+        right away.
+        """
+        app.logger.info("Request for the events of shopcart %s", shopcart_id)
+        bus = get_bus()
+        if bus.subscriber_count >= app.config["EVENTS_MAX_SUBSCRIBERS"]:
+            raise ServiceUnavailable(
+                "No room for another event stream, retry later",
+                retry_after=app.config["ADMISSION_RETRY_AFTER"],
+            )
+
+        # subscribe before reading the version, so no change falls in between
+        events = bus.subscribe(shopcart_id)
+        shopcart = Shopcart.find(shopcart_id, ("id", "version"))
+        if not shopcart:
+            bus.unsubscribe(shopcart_id, events)
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id '{shopcart_id}' could not be found.",
+            )
+
+        last_event_id = request.headers.get("Last-Event-ID", request.args.get("since"))
+        return event_stream(bus, events, shopcart, last_event_id)
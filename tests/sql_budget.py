@@ -0,0 +1,100 @@
+"""
+SQL Budgets for the test suite
+
+Records the SQL that a block of test code sends to the database so tests
+can assert that an endpoint stays within its declared budget of round
+trips and SQL time. Commits count as round trips, so an extra commit in a
+model method breaks the budget just like an N+1 query does.
+"""
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+from service.models import db
+
+# Round trips and milliseconds of SQL allowed per request, per endpoint. The
+# item endpoints are budgeted for a cart of 3 Items, as the tests use.
+SQL_BUDGETS = {
+    "GET /livez": (0, 0),
+    "GET /readyz": (0, 0),
+    "GET /api/shopcarts": (2, 200),
+    "GET /api/shopcarts/{id}": (2, 100),
+    "POST /api/shopcarts": (3, 100),
+    "PUT /api/shopcarts/{id}": (4, 100),
+    "DELETE /api/shopcarts/{id}": (3, 100),
+    "POST /api/shopcarts:batchGet": (2, 100),
+    "POST /api/shopcarts/{id}/merge": (13, 100),
+    "GET /api/shopcarts/{id}/changes": (2, 100),
+    "GET /api/customers/{id}/shopcart": (2, 100),
+    "POST /api/customers/{id}/shopcart": (5, 100),
+    "GET /api/shopcarts/{id}/items": (2, 100),
+    "POST /api/shopcarts/{id}/items": (7, 100),
+    "POST /api/shopcarts/{id}/items upsert": (6, 100),
+    "DELETE /api/shopcarts/{id}/items": (10, 100),
+    "GET /api/shopcarts/{id}/items/{item_id}": (2, 100),
+    "PUT /api/shopcarts/{id}/items/{item_id}": (8, 100),
+    "PATCH /api/shopcarts/{id}/items/{item_id}": (5, 100),
+    "DELETE /api/shopcarts/{id}/items/{item_id}": (8, 100),
+}
+
+
+class SqlRecorder:
+    """Collects the statements and commits sent through an engine"""
+
+    def __init__(self):
+        self.statements = []
+        self.seconds = 0.0
+        self._started = []
+
+    def before_execute(self, conn, cursor, statement, *args):
+        """Starts timing a statement"""
+        # pylint: disable=unused-argument
+        self._started.append(time.perf_counter())
+
+    def after_execute(self, conn, cursor, statement, *args):
+        """Records a statement and the time it took"""
+        # pylint: disable=unused-argument
+        self.seconds += time.perf_counter() - self._started.pop()
+        self.statements.append(statement)
+
+    def commit(self, conn):
+        """Records a commit"""
+        # pylint: disable=unused-argument
+        self.statements.append("COMMIT")
+
+    @contextmanager
+    def listening(self, engine):
+        """Records everything sent through engine inside the with block"""
+        events = (
+            ("before_cursor_execute", self.before_execute),
+            ("after_cursor_execute", self.after_execute),
+            ("commit", self.commit),
+        )
+        for name, listener in events:
+            event.listen(engine, name, listener)
+        try:
+            yield self
+        finally:
+            for name, listener in events:
+                event.remove(engine, name, listener)
+
+
+class SqlBudgetMixin:  # pylint: disable=too-few-public-methods
+    """Adds SQL budget assertions to a TestCase"""
+
+    @contextmanager
+    def assert_sql_budget(self, endpoint):
+        """Fails if the with block exceeds the SQL_BUDGETS entry of endpoint"""
+        max_queries, max_ms = SQL_BUDGETS[endpoint]
+        with SqlRecorder().listening(db.engine) as recorder:
+            yield recorder
+        queries = "\n".join(recorder.statements)
+        self.assertLessEqual(
+            len(recorder.statements),
+            max_queries,
+            f"{endpoint} ran {len(recorder.statements)} queries:\n{queries}",
+        )
+        self.assertLessEqual(
+            recorder.seconds * 1000,
+            max_ms,
+            f"{endpoint} spent {recorder.seconds * 1000:.1f} ms in SQL",
+        )
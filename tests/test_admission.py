@@ -0,0 +1,141 @@
+"""
+Admission Control Test Suite
+
+Test cases can be run with the following:
+  green -vvv tests/test_admission.py
+"""
+import threading
+from unittest import TestCase
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from service import app
+from service.common import status
+from service.common.admission import AdmissionController, AimdLimit, priority
+
+# a limit of 10 that can not grow: 5 scans, 8 reads or 10 writes
+CONFIG = {
+    "ADMISSION_INITIAL_LIMIT": 10,
+    "ADMISSION_MIN_LIMIT": 2,
+    "ADMISSION_MAX_LIMIT": 10,
+    "ADMISSION_TARGET_MS": 250,
+    "ADMISSION_RETRY_AFTER": 3,
+}
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestAdmissionControl(TestCase):
+    """Admission Control Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.controller = AdmissionController(self._wsgi_app, CONFIG)
+        self.client = Client(self.controller)
+
+    @staticmethod
+    def _wsgi_app(environ, start_response):
+        """Answers every request with 200 OK"""
+        return Response("ok")(environ, start_response)
+
+    def _hold(self, count):
+        """Makes count requests look in flight"""
+        self.controller.inflight = count
+
+    def test_priority(self):
+        """It should rank writes over reads over scans"""
+        self.assertEqual(
+            priority({"REQUEST_METHOD": "GET", "PATH_INFO": "/api/shopcarts"}), "scan"
+        )
+        self.assertEqual(
+            priority(
+                {"REQUEST_METHOD": "POST", "PATH_INFO": "/api/shopcarts:batchGet"}
+            ),
+            "scan",
+        )
+        self.assertEqual(
+            priority({"REQUEST_METHOD": "GET", "PATH_INFO": "/api/shopcarts/1"}), "read"
+        )
+        self.assertEqual(
+            priority({"REQUEST_METHOD": "POST", "PATH_INFO": "/api/shopcarts/1/items"}),
+            "write",
+        )
+
+    def test_admit(self):
+        """It should admit requests under the limit"""
+        response = self.client.get("/api/shopcarts")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.controller.inflight, 0)
+
+    def test_shed_scans_first(self):
+        """It should shed scans, then reads, and writes last"""
+        self._hold(5)
+        self.assertEqual(self.client.get("/api/shopcarts").status_code, 503)
+        self.assertEqual(self.client.get("/api/shopcarts/1").status_code, 200)
+        self._hold(8)
+        self.assertEqual(self.client.get("/api/shopcarts/1").status_code, 503)
+        self.assertEqual(self.client.post("/api/shopcarts/1/items").status_code, 200)
+        self._hold(10)
+        response = self.client.post("/api/shopcarts/1/items")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.headers["Retry-After"], "3")
+        self.assertEqual(response.json["error"], "Service Unavailable")
+        self.assertEqual(self.controller.rejected, 3)
+
+    def test_probes_bypass(self):
+        """It should never shed requests outside the API"""
+        self._hold(100)
+        self.assertEqual(self.client.get("/").status_code, status.HTTP_200_OK)
+
+    def test_aimd(self):
+        """It should grow the limit while fast and shrink it when slow"""
+        limit = AimdLimit(4, 2, 5, 0.25)
+        limit.update(0.01, 2)
+        self.assertEqual(limit.limit, 5)
+        limit.update(0.01, 5)
+        self.assertEqual(limit.limit, 5)
+        limit.update(1.0, 5)
+        self.assertEqual(limit.limit, 4.5)
+        for _ in range(20):
+            limit.update(1.0, 1)
+        self.assertEqual(limit.limit, 2)
+        limit.update(0.01, 0)
+        self.assertEqual(limit.limit, 2)
+
+    def test_concurrent_requests(self):
+        """It should count the requests in flight across threads"""
+        release = threading.Event()
+        entered = threading.Semaphore(0)
+
+        def slow_app(environ, start_response):
+            entered.release()
+            release.wait(5)
+            return Response("ok")(environ, start_response)
+
+        config = dict(CONFIG, ADMISSION_INITIAL_LIMIT=3, ADMISSION_MAX_LIMIT=3)
+        controller = AdmissionController(slow_app, config)
+        client = Client(controller)
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    client.get("/api/shopcarts/1").status_code
+                )
+            )
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            entered.acquire(timeout=5)  # pylint: disable=consider-using-with
+        self.assertEqual(controller.inflight, 3)
+        self.assertEqual(client.get("/api/shopcarts/1").status_code, 503)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [200] * 3)
+        self.assertEqual(controller.inflight, 0)
+
+    def test_installed(self):
+        """It should wrap the app of the service"""
+        self.assertIsInstance(app.wsgi_app, AdmissionController)
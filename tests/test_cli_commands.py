@@ -2,10 +2,17 @@
 CLI Command Extensions for Flask
 """
 import os
+from decimal import Decimal
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service.common.cli_commands import (
+    db_create,
+    sweep_carts,
+    archive_carts,
+    sweep_idempotency_keys,
+    reprice,
+)
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +28,66 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch("service.common.cli_commands.Shopcart")
+    def test_sweep_carts(self, shopcart_mock):
+        """It should delete stale carts until a batch comes back short"""
+        shopcart_mock.delete_stale.side_effect = [10, 10, 3]
+        result = self.runner.invoke(
+            sweep_carts, ["--days", "30", "--batch-size", "10", "--rate", "1000"]
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(shopcart_mock.delete_stale.call_count, 3)
+        self.assertIn("Batch 3: 3 rows, 23 in total", result.output)
+        self.assertIn("Deleted 23 shopcarts", result.output)
+
+    @patch("service.common.cli_commands.Shopcart")
+    def test_archive_carts(self, shopcart_mock):
+        """It should archive old carts in batches"""
+        shopcart_mock.archive_old.side_effect = [5, 0]
+        result = self.runner.invoke(
+            archive_carts, ["--days", "30", "--batch-size", "5", "--rate", "1000"]
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(shopcart_mock.archive_old.call_count, 2)
+        self.assertIn("Archived 5 shopcarts", result.output)
+
+    @patch("service.common.cli_commands.idempotency")
+    def test_sweep_idempotency_keys(self, idempotency_mock):
+        """It should delete expired Idempotency-Keys in batches"""
+        idempotency_mock.sweep.side_effect = [4, 1]
+        result = self.runner.invoke(
+            sweep_idempotency_keys, ["--batch-size", "4", "--rate", "1000"]
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(idempotency_mock.sweep.call_count, 2)
+        self.assertIn("Deleted 5 expired Idempotency-Keys", result.output)
+
+    @patch("service.common.cli_commands.Item")
+    def test_reprice(self, item_mock):
+        """It should reprice items from a price feed in batches"""
+        item_mock.reprice.side_effect = [4, 1]
+        with self.runner.isolated_filesystem():
+            with open("prices.csv", "w", encoding="utf-8") as feed:
+                feed.write("name,price\napple,1.25\npear,2\nplum,3.5\n")
+            result = self.runner.invoke(
+                reprice, ["prices.csv", "--batch-size", "2", "--rate", "1000"]
+            )
+        self.assertEqual(result.exit_code, 0)
+        item_mock.reprice.assert_any_call(
+            {"apple": Decimal("1.25"), "pear": Decimal("2")}
+        )
+        item_mock.reprice.assert_any_call({"plum": Decimal("3.5")})
+        self.assertIn("Read 3 prices and repriced 5 items", result.output)
+
+    @patch("service.common.cli_commands.Item")
+    def test_reprice_bad_feed(self, item_mock):
+        """It should stop at a price feed row that is not a price"""
+        for price in ("cheap", "NaN", "Infinity"):
+            with self.runner.isolated_filesystem():
+                with open("prices.csv", "w", encoding="utf-8") as feed:
+                    feed.write(f"name,price\napple,{price}\n")
+                result = self.runner.invoke(reprice, ["prices.csv"])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("not name,price", result.output)
+        item_mock.reprice.assert_not_called()
@@ -5,8 +5,18 @@ Test cases for YourResourceModel Model
 import os
 import logging
 import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
 from service import app
-from service.models import Shopcart, Item, db, DataValidationError
+from service.models import (
+    Shopcart,
+    Item,
+    ShopcartArchive,
+    ItemArchive,
+    db,
+    DataValidationError,
+    compile_serializer,
+)
 from tests.factories import ShopcartFactory, ItemFactory
 
 DATABASE_URI = os.getenv(
@@ -90,6 +100,48 @@ class TestShopcart(unittest.TestCase):
         self.assertEqual(items[0]["description"], item.description)
         self.assertEqual(items[0]["quantity"], item.quantity)
 
+    def test_serialize_shopcart_fields(self):
+        """It should Serialize only the requested fields of a shopcart"""
+        shopcart = ShopcartFactory()
+        shopcart.items.append(ItemFactory())
+        serial_shopcart = shopcart.serialize(("id", "last_updated_time"))
+        self.assertEqual(
+            serial_shopcart,
+            {
+                "id": shopcart.id,
+                "last_updated_time": shopcart.last_updated_time.isoformat(),
+            },
+        )
+
+    def test_find_shopcart_fields(self):
+        """It should Find a shopcart loading only the requested fields"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        shopcart_id = shopcart.id
+        db.session.expunge_all()
+
+        found = Shopcart.find(shopcart_id, ("total_price",))
+        self.assertEqual(found.serialize(("total_price",)), {"total_price": 0.0})
+        self.assertIn("customer_id", db.inspect(found).unloaded)
+
+    def test_compile_serializer(self):
+        """It should reuse one compiled serializer per model and projection"""
+        self.assertIs(compile_serializer(Shopcart), compile_serializer(Shopcart))
+        self.assertIsNot(
+            compile_serializer(Shopcart), compile_serializer(Shopcart, ("id",))
+        )
+        shopcart = ShopcartFactory(last_updated_time=None)
+        self.assertIsNone(
+            shopcart.serialize(("last_updated_time",))["last_updated_time"]
+        )
+
+    def test_check_fields(self):
+        """It should validate field projections"""
+        self.assertIsNone(Shopcart.check_fields(None))
+        self.assertEqual(Item.check_fields(["id", "name"]), ("id", "name"))
+        self.assertEqual(Item.check_fields(["name", "id", "name"]), ("id", "name"))
+        self.assertRaises(DataValidationError, Item.check_fields, ["id", "bogus"])
+
     def test_deserialize_an_shopcart(self):
         """It should Deserialize an shopcart"""
         shopcart = ShopcartFactory()
@@ -110,6 +162,213 @@ class TestShopcart(unittest.TestCase):
         for new, old in zip(new_shopcart.items, shopcart.items):
             self.assertEqual(new.id, old.id)
 
+    def test_find_by_customer(self):
+        """It should Find the newest Shopcart of a customer"""
+        shopcarts = [
+            ShopcartFactory(customer_id=customer_id) for customer_id in (7, 7, 8)
+        ]
+        for shopcart in shopcarts:
+            shopcart.create()
+        newest = Shopcart.find_by_customer(7)
+        self.assertEqual(newest.id, shopcarts[1].id)
+        self.assertIsNone(Shopcart.find_by_customer(9))
+
+    def test_find_or_create_by_customer(self):
+        """It should Create a Shopcart for a customer only when it has none"""
+        shopcart, created = Shopcart.find_or_create_by_customer(7)
+        self.assertTrue(created)
+        self.assertEqual(shopcart.customer_id, 7)
+        self.assertEqual(shopcart.total_price, 0)
+        self.assertEqual(shopcart.items, [])
+        again, created = Shopcart.find_or_create_by_customer(7)
+        self.assertFalse(created)
+        self.assertEqual(again.id, shopcart.id)
+        self.assertEqual(len(Shopcart.all()), 1)
+
+    def test_change_item_quantity(self):
+        """It should Add to or set the quantity of an Item and the cart total"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        item = ItemFactory(shopcart=shopcart, price=2.5, quantity=2)
+        item.create()
+        ItemFactory(shopcart=shopcart, price=1.0, quantity=1).create()
+        shopcart_id, item_id = shopcart.id, item.id
+
+        self.assertEqual(Item.change_quantity(shopcart_id, item_id, "+2").quantity, 4)
+        self.assertEqual(Item.change_quantity(shopcart_id, item_id, "-1").quantity, 3)
+        self.assertEqual(Shopcart.find(shopcart_id).total_price, 8.5)
+        self.assertEqual(Item.change_quantity(shopcart_id, item_id, 6).quantity, 6)
+        self.assertEqual(Shopcart.find(shopcart_id).total_price, 16.0)
+        self.assertRaises(
+            DataValidationError, Item.change_quantity, shopcart_id, item_id, "-7"
+        )
+        self.assertIsNone(Item.change_quantity(0, item_id, "+1"))
+        self.assertIsNone(Item.change_quantity(shopcart_id, 0, 1))
+
+    def test_parse_quantity_change(self):
+        """It should Parse absolute and relative quantity changes"""
+        self.assertEqual(Item.parse_quantity_change("+1"), (1, True))
+        self.assertEqual(Item.parse_quantity_change("-2"), (-2, True))
+        self.assertEqual(Item.parse_quantity_change(3), (3, False))
+        self.assertEqual(Item.parse_quantity_change("3"), (3, False))
+        self.assertEqual(Item.parse_quantity_change(3.0), (3, False))
+        for change in (-1, "one", None, True, "1.5", 2.7, float("inf")):
+            self.assertRaises(DataValidationError, Item.parse_quantity_change, change)
+
+    def test_reprice_items(self):
+        """It should Reprice Items by name and refresh their cart totals"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        ItemFactory(shopcart=shopcart, name="apple", price=1.0, quantity=2).create()
+        ItemFactory(shopcart=shopcart, name="pear", price=3.0, quantity=1).create()
+        other = ShopcartFactory()
+        other.create()
+        ItemFactory(shopcart=other, name="pear", price=3.0, quantity=1).create()
+        ids = (shopcart.id, other.id)
+
+        prices = {"apple": Decimal("1.25"), "plum": Decimal("9")}
+        self.assertEqual(Item.reprice(prices), 1)
+        db.session.remove()
+        self.assertEqual(Shopcart.find(ids[0]).total_price, Decimal("5.5"))
+        self.assertEqual(Shopcart.find(ids[1]).total_price, 0)
+        self.assertEqual(Item.reprice({"plum": Decimal("9")}), 0)
+
+    def test_search_shopcarts(self):
+        """It should Search Shopcarts as dicts with the filters in SQL"""
+        cheap = ShopcartFactory(customer_id=1)
+        cheap.create()
+        apple = ItemFactory(shopcart=cheap, name="apple", price=1.0, quantity=2)
+        apple.create()
+        dear = ShopcartFactory(customer_id=2)
+        dear.create()
+        ItemFactory(shopcart=dear, name="pear", price=30.0, quantity=1).create()
+        Shopcart.refresh_totals([cheap.id, dear.id])
+        ids = (cheap.id, dear.id)
+
+        found = Shopcart.search()
+        self.assertEqual([cart["id"] for cart in found], list(ids))
+        self.assertEqual(found[0], Shopcart.find(ids[0]).serialize())
+        self.assertEqual(Shopcart.search(customer_id=2)[0]["id"], ids[1])
+        self.assertEqual(Shopcart.search(item_id=apple.id)[0]["id"], ids[0])
+        self.assertEqual(len(Shopcart.search(max_price=Decimal("2.0"))), 1)
+        self.assertEqual(len(Shopcart.search(min_price=Decimal("2.01"))), 1)
+        self.assertEqual(Shopcart.search(customer_id=3), [])
+        projected = Shopcart.search(("items",), customer_id=1)
+        self.assertEqual(list(projected[0]), ["items"])
+        self.assertEqual(projected[0]["items"][0]["name"], "apple")
+        self.assertEqual(
+            Shopcart.search(("total_price",)),
+            [{"total_price": 2.0}, {"total_price": 30.0}],
+        )
+
+    def test_search_items(self):
+        """It should Search the Items of a Shopcart as dicts"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        ItemFactory(shopcart=shopcart, name="Green Apple", price=1.5).create()
+        ItemFactory(shopcart=shopcart, name="pear", price=3.0).create()
+        names = [item["name"] for item in Item.search(shopcart.id)]
+        self.assertEqual(names, ["Green Apple", "pear"])
+        self.assertEqual(
+            Item.search(shopcart.id, ("name",), name="APPLE"), [{"name": "Green Apple"}]
+        )
+        self.assertEqual(
+            Item.search(shopcart.id, ("price",), price=Decimal("3")), [{"price": 3.0}]
+        )
+        self.assertEqual(Item.search(shopcart.id, name="%"), [])
+        self.assertEqual(Item.search(0), [])
+
+    def test_merge_shopcarts(self):
+        """It should Merge the items of one shopcart into another"""
+        customer = ShopcartFactory()
+        customer.create()
+        ItemFactory(shopcart=customer, name="apple", price=1.0, quantity=2).create()
+        ItemFactory(shopcart=customer, name="pear", price=3.0, quantity=1).create()
+        guest = ShopcartFactory()
+        guest.create()
+        ItemFactory(shopcart=guest, name="apple", price=1.0, quantity=3).create()
+        ItemFactory(shopcart=guest, name="plum", price=2.0, quantity=1).create()
+        ItemFactory(shopcart=guest, name="plum", price=2.0, quantity=1).create()
+        customer_id, guest_id = customer.id, guest.id
+
+        customer.merge(guest)
+        db.session.remove()
+        merged = Shopcart.find(customer_id)
+        quantities = sorted((item.name, item.quantity) for item in merged.items)
+        self.assertEqual(
+            quantities, [("apple", 5), ("pear", 1), ("plum", 1), ("plum", 1)]
+        )
+        self.assertEqual(merged.total_price, 12.0)
+        self.assertIsNone(Shopcart.find(guest_id))
+        self.assertEqual(Item.find_by_shopcart(guest_id), [])
+
+    def test_add_item_upserts_by_name(self):
+        """It should Add to the quantity of an Item with the same name"""
+        app.config["UNIQUE_LINE_ITEMS"] = True
+        try:
+            Shopcart.init_db(app)
+            shopcart = ShopcartFactory(total_price=0)
+            shopcart.create()
+            data = ItemFactory(shopcart_id=0, name="apple", price=2.0, quantity=1)
+            first = Item.add(shopcart.id, data.serialize())
+            data.quantity = 3
+            second = Item.add(shopcart.id, data.serialize())
+            self.assertEqual(first.id, second.id)
+            self.assertEqual(second.quantity, 4)
+            self.assertEqual(second.shopcart_id, shopcart.id)
+            self.assertEqual(len(Item.find_by_shopcart(shopcart.id)), 1)
+            self.assertEqual(Shopcart.find(shopcart.id).total_price, 8.0)
+            self.assertIsNone(Item.add(0, data.serialize()))
+        finally:
+            app.config["UNIQUE_LINE_ITEMS"] = False
+            Item.unique_name_index().drop(db.engine)
+
+    def test_delete_stale_shopcarts(self):
+        """It should Delete a batch of stale shopcarts and their items"""
+        old_time = datetime.now() - timedelta(days=100)
+        for _ in range(3):
+            shopcart = ShopcartFactory()
+            shopcart.create()
+            shopcart.last_updated_time = old_time
+            shopcart.update()
+            item = ItemFactory(shopcart=shopcart)
+            item.create()
+        fresh = ShopcartFactory()
+        fresh.create()
+        cutoff = datetime.now() - timedelta(days=90)
+
+        self.assertEqual(Shopcart.delete_stale(cutoff, 2), 2)
+        self.assertEqual(Shopcart.delete_stale(cutoff, 2), 1)
+        self.assertEqual(Shopcart.delete_stale(cutoff, 2), 0)
+        self.assertEqual([cart.id for cart in Shopcart.all()], [fresh.id])
+        self.assertEqual(Item.all(), [])
+
+    def test_archive_old_shopcarts(self):
+        """It should move old shopcarts and their items to the archive"""
+        db.session.query(ItemArchive).delete()
+        db.session.query(ShopcartArchive).delete()
+        old = ShopcartFactory()
+        old.create()
+        old.creation_time = datetime.now() - timedelta(days=400)
+        old.update()
+        ItemFactory(shopcart=old).create()
+        new = ShopcartFactory()
+        new.create()
+        expected = old.serialize()
+        cutoff = datetime.now() - timedelta(days=365)
+
+        self.assertEqual(Shopcart.archive_old(cutoff, 10), 1)
+        self.assertEqual(Shopcart.archive_old(cutoff, 10), 0)
+        self.assertIsNone(Shopcart.find(old.id))
+        self.assertEqual([cart.id for cart in Shopcart.all()], [new.id])
+
+        archived = Shopcart.find(old.id, include_archived=True)
+        self.assertIsInstance(archived, ShopcartArchive)
+        self.assertEqual(archived.serialize(), expected)
+        self.assertEqual(len(Shopcart.all(include_archived=True)), 2)
+        self.assertRaises(DataValidationError, archived.deserialize, expected)
+        self.assertRaises(DataValidationError, archived.items[0].deserialize, {})
+
     def test_deserialize_shopcart_with_key_error(self):
         """It should not Deserialize an shopcart with a KeyError"""
         shopcart = Shopcart()
@@ -120,6 +379,46 @@ class TestShopcart(unittest.TestCase):
         shopcart = Shopcart()
         self.assertRaises(DataValidationError, shopcart.deserialize, [])
 
+    def test_money_is_exact(self):
+        """It should Add up prices without floating point drift"""
+        shopcart = ShopcartFactory()
+        shopcart.items = [
+            Item().deserialize(
+                {
+                    "shopcart_id": 0,
+                    "name": "cent",
+                    "price": 0.1,
+                    "description": "",
+                    "quantity": 3,
+                }
+            )
+            for _ in range(10)
+        ]
+        self.assertEqual(shopcart.get_total_price(), Decimal("3.0"))
+        shopcart.create()
+        shopcart_id = shopcart.id
+        self.assertEqual(Shopcart.refresh_totals([shopcart_id]), 1)
+        db.session.remove()
+        found = Shopcart.find(shopcart_id)
+        self.assertEqual(found.total_price, Decimal("3.0"))
+        self.assertEqual(found.serialize(("total_price",)), {"total_price": 3.0})
+        self.assertIsInstance(found.items[0].serialize()["price"], float)
+
+    def test_deserialize_item_bad_price(self):
+        """It should not Deserialize an Item with a price that is not a number"""
+        data = ItemFactory(shopcart_id=1).serialize()
+        data["price"] = "ten"
+        self.assertRaises(DataValidationError, Item().deserialize, data)
+        for price in ("NaN", "sNaN", "Infinity", float("-inf")):
+            data["price"] = price
+            self.assertRaises(DataValidationError, Item().deserialize, data)
+
+    def test_deserialize_item_rounds_price(self):
+        """It should Deserialize a price to the places that are stored"""
+        data = ItemFactory(shopcart_id=1).serialize()
+        data["price"] = 0.012345
+        self.assertEqual(Item().deserialize(data).price, Decimal("0.0123"))
+
     def test_deserialize_item_key_error(self):
         """It should not Deserialize an Item with a KeyError"""
         item = Item()
@@ -228,7 +527,8 @@ class TestItems(unittest.TestCase):
         # id should not be same cause we were making a new item, just with same name
         self.assertNotEqual(new_item_from_serial.id, sample_item.id)
         self.assertEqual(new_item_from_serial.name, sample_item.name)
-        self.assertEqual(new_item_from_serial.price, sample_item.price)
+        # money is deserialized as an exact Decimal
+        self.assertEqual(new_item_from_serial.price, Decimal("10.99"))
         self.assertEqual(new_item_from_serial.shopcart_id, sample_item.shopcart_id)
 
     def test_deserialize_item_key_error(self):